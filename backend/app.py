@@ -1,11 +1,54 @@
-from fastapi import FastAPI, Request, Response, HTTPException, Depends
+from fastapi import FastAPI, Request, Response, HTTPException, Depends, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+import asyncio
 import httpx
 import os
+import time
 
-app = FastAPI()
+from batch import BatchRunner
+from cache import ResponseCache, cache_key, cache_mode, credential_digest
+from journal import Journal, session_key
+from metrics import Metrics, MetricsMiddleware, StreamObserver, current_timing, error_class, observe_upstream, scan_usage
+from pipeline import FlowEngine, FlowLimitExceeded
+from prompts import cached_prompt_tokens, compact_request, report_headers
+from providers import ADAPTERS, ProxyError, RawBody, dumps
+from resilience import CircuitOpen, LimitExceeded, Resilience, estimate_tokens
+from sessions import ServerSessionMiddleware, SessionManager
+from singleflight import SingleFlight
+from streaming import RelayResponse, relay, stream_payload
+from upstream import UpstreamClients
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared, pooled upstream clients: one per provider for the app's lifetime
+    await app.state.upstream.start()
+    await app.state.journal.start()
+    if os.environ.get("LLM_PROFILE") == "1":
+        app.state.metrics.profiler.start(float(os.environ.get("LLM_PROFILE_INTERVAL", 0.005)))
+    try:
+        yield
+    finally:
+        app.state.metrics.profiler.stop()
+        await app.state.flows.aclose()
+        await app.state.upstream.aclose()
+        await app.state.journal.aclose()
+        app.state.cache.close()
+        app.state.sessions.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.state.upstream = UpstreamClients()
+app.state.cache = ResponseCache.from_env()
+app.state.inflight = SingleFlight()
+app.state.batch = BatchRunner.from_env()
+app.state.flows = FlowEngine.from_env()
+app.state.resilience = Resilience()
+app.state.metrics = Metrics()
+app.state.sessions = SessionManager.from_env()
+app.state.journal = Journal.from_env()
 
 # CORS for local dev
 app.add_middleware(
@@ -16,14 +59,60 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Session middleware (use a strong secret in production!)
-app.add_middleware(SessionMiddleware, secret_key=os.environ.get("SESSION_SECRET", "dev-secret"))
+# Server-side sessions: the cookie holds an opaque id, credentials stay in app.state.sessions
+app.add_middleware(ServerSessionMiddleware, https_only=os.environ.get("SESSION_HTTPS_ONLY") == "1")
+
+# Per-request timing for /api/llm/* (proxy overhead and request sizes)
+app.add_middleware(MetricsMiddleware, routes=(*ADAPTERS, "batch"))
 
 # Health check
 @app.get("/api/health")
 def health():
     return {"status": "ok"}
 
+# Response cache counters
+@app.get("/api/cache/stats")
+def cache_stats(request: Request):
+    return request.app.state.cache.stats()
+
+# Per-provider limiter, concurrency and circuit state
+@app.get("/api/resilience/stats")
+def resilience_stats(request: Request):
+    return request.app.state.resilience.stats()
+
+# Prometheus text exposition of the proxy's per-provider/model metrics
+@app.get("/api/metrics")
+def metrics(request: Request):
+    state = request.app.state
+    gauges = (
+        ("llm_cache_entries", "Responses held in the in-memory cache.", state.cache.stats()["size"]),
+        ("llm_inflight_requests", "Distinct upstream calls currently in flight.", len(state.inflight)),
+    )
+    return PlainTextResponse(state.metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+# Sampling profiler: GET returns collapsed stacks (flamegraph input), POST
+# {"enabled": bool, "interval": seconds, "reset": bool} switches it at runtime
+@app.get("/api/metrics/profile")
+def profile(request: Request):
+    return PlainTextResponse(request.app.state.metrics.profiler.collapsed())
+
+@app.post("/api/metrics/profile")
+async def toggle_profile(request: Request):
+    data = await request.json()
+    profiler = request.app.state.metrics.profiler
+    if data.get("reset"):
+        profiler.reset()
+    if data.get("enabled"):
+        interval = data.get("interval")
+        try:
+            # Handlers run on the event loop thread, which is the one worth sampling
+            profiler.start(float(interval) if interval is not None else None)
+        except (TypeError, ValueError):
+            return JSONResponse({"error": "interval must be a positive number of seconds"}, status_code=400)
+    elif "enabled" in data:
+        profiler.stop()
+    return profiler.status()
+
 # Store credentials for all providers in session
 @app.post("/api/session/set_key")
 async def set_key(request: Request):
@@ -50,100 +139,285 @@ async def get_key(request: Request):
             result[field] = value
     return result
 
-# Proxy to OpenAI
-@app.post("/api/llm/openai")
-async def llm_openai(request: Request):
-    data = await request.json()
-    api_key = data.get("apiKey") or request.session.get("openai_apiKey") or os.environ.get("OPENAI_API_KEY")
-    model = data.get("model") or request.session.get("openai_model") or "gpt-3.5-turbo"
-    if not api_key:
-        return JSONResponse({"error": "API key is required"}, status_code=400)
-    headers = {"Authorization": f"Bearer {api_key}"}
-    payload = {
-        "model": model,
-        "messages": data.get("messages", []),
-        "max_tokens": data.get("max_tokens", 1000),
-        "temperature": data.get("temperature", 0.7),
-    }
+# Run one non-streaming call and record it in the call journal; `owner` is
+# the caller's session_key. Returns (status_code, body, cache_state) like _call.
+async def _complete(state, provider: str, data: dict, session, owner=None) -> tuple:
+    started, clock = time.time(), time.perf_counter()
+    status, body, cache_state = await _call(state, provider, data, session)
+    state.journal.record(provider, data, session, owner, started, time.perf_counter() - clock,
+                         status, body, cache_state)
+    return status, body, cache_state
+
+# One non-streaming call: deterministic calls are answered from the
+# response cache when possible, identical in-flight calls are coalesced, and
+# the upstream request goes through the provider's rate limits, retries and
+# circuit breaker. Returns (status_code, body, cache_state) and never raises;
+# on success body is the upstream RawBody, otherwise an error dict.
+async def _call(state, provider: str, data: dict, session) -> tuple:
+    adapter = ADAPTERS[provider]
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=60.0
-            )
+        url, headers, payload = adapter.build(data, session)
+        read_cache, write_cache = cache_mode(data, payload)
+    except (ProxyError, ValueError) as e:
+        state.metrics.call(provider, data.get("model") or "-").errors["bad_request"] += 1
+        return getattr(e, "status_code", 400), {"error": str(e)}, None
+    series = state.metrics.call(provider, payload["model"])
+    cache = state.cache
+    key = None
+    if read_cache or write_cache:
+        # Scoped to the caller's credential: a cached answer must not skip upstream authentication
+        key = cache_key(provider, url, {"payload": payload, "auth": credential_digest(headers)})
+    if read_cache:
+        cached = await cache.aget(key)
+        if cached is not None:
+            series.response_bytes.observe(len(cached.content))
+            return 200, cached, "HIT"
+    client = state.upstream.get(provider)
+    guard = state.resilience.guard(provider, headers)
+
+    async def fetch():
+        # Keys above are computed from `payload`; provider rewrites (prompt caching) only touch the wire copy
+        wire = adapter.wire_payload(payload, data)
+        resp = await guard.send(lambda: client.post(url, headers=headers, json=wire), tokens=estimate_tokens(payload))
         resp.raise_for_status()
-        return resp.json()
-    except httpx.HTTPStatusError as e:
-        return JSONResponse({"error": e.response.text}, status_code=e.response.status_code)
+        # Relay the upstream bytes untouched; nothing on this path parses them
+        result = RawBody(resp.content, resp.headers.get("content-type", "application/json"))
+        # Counted once per upstream call, not per coalesced waiter
+        series.usage(*scan_usage(result.content))
+        if write_cache:
+            cache.set(key, result)
+        return result
+
+    started = time.perf_counter()
+    try:
+        # Identical concurrent calls (same payload and credentials) share one upstream request
+        flight_key = cache_key(provider, url, {"payload": payload, "headers": headers})
+        result = await state.inflight.do(flight_key, fetch)
     except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
+        series.errors[error_class(e)] += 1
+        return _error_result(e)
+    finally:
+        observe_upstream(series, started)
+    series.response_bytes.observe(len(result.content))
+    return 200, result, "MISS" if key else "BYPASS"
+
+def _error_result(e) -> tuple:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code, {"error": e.response.text}, None
+    if isinstance(e, CircuitOpen):
+        return e.status_code, {"error": str(e), "retryAfter": round(e.retry_after, 1)}, None
+    if isinstance(e, LimitExceeded):
+        return e.status_code, {"error": str(e)}, None
+    return 500, {"error": str(e)}, None
+
+# _complete with the upstream body parsed into the unified {content, model, usage} schema
+async def _complete_normalized(state, provider: str, data: dict, session, owner=None) -> tuple:
+    status, body, cache_state = await _complete(state, provider, data, session, owner)
+    if isinstance(body, RawBody):
+        try:
+            body = ADAPTERS[provider].normalize(body.json(), data.get("model"))
+        except Exception as e:
+            return 502, {"error": f"Unreadable {provider} response: {e}"}, cache_state
+    return status, body, cache_state
+
+# Open a streaming call and relay the provider's deltas to the browser as
+# normalized SSE events. The journal entry is written when the stream ends.
+async def _stream(state, provider: str, data: dict, session, owner=None):
+    adapter = ADAPTERS[provider]
+    wall, clock = time.time(), time.perf_counter()
+
+    def journal(status, error=None, usage=None):
+        state.journal.record(provider, data, session, owner, wall, time.perf_counter() - clock, status,
+                             usage=usage, error=error)
+
+    try:
+        url, headers, payload = adapter.build(data, session)
+    except ProxyError as e:
+        state.metrics.call(provider, data.get("model") or "-").errors["bad_request"] += 1
+        journal(e.status_code, str(e))
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    series = state.metrics.call(provider, payload["model"])
+    client = state.upstream.get(provider)
+    guard = state.resilience.guard(provider, headers)
+    started = time.perf_counter()
+    try:
+        upstream_request = client.build_request("POST", url, headers=headers, json=stream_payload(provider, adapter.wire_payload(payload, data)))
+        # Retries and limits apply until the stream opens; once deltas flow they are relayed as-is.
+        # The concurrency slot stays held until the relay has closed the stream.
+        resp, release = await guard.send(lambda: client.send(upstream_request, stream=True),
+                                         tokens=estimate_tokens(payload), hold=True)
+        if resp.is_error:
+            try:
+                await resp.aread()
+                await resp.aclose()
+            finally:
+                release()
+            resp.raise_for_status()
+    except Exception as e:
+        series.errors[error_class(e)] += 1
+        observe_upstream(series, started)
+        response = _stream_error(e)
+        journal(response.status_code, error_class(e))
+        return response
+
+    def finished(usage, error):
+        release()
+        journal(200, error and error_class(error), usage or None)
+
+    observer = StreamObserver(series, started, finished)
+    return RelayResponse(relay(provider, resp, payload["model"], observer))
+
+def _stream_error(e):
+    if isinstance(e, httpx.HTTPStatusError):
+        return JSONResponse({"error": e.response.text}, status_code=e.response.status_code)
+    if isinstance(e, CircuitOpen):
+        return JSONResponse({"error": str(e)}, status_code=e.status_code,
+                            headers={"Retry-After": str(int(e.retry_after))})
+    if isinstance(e, LimitExceeded):
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    return JSONResponse({"error": str(e)}, status_code=500)
+
+# Non-streaming replies are the provider's raw bytes with the original content
+# type; "normalize": true returns the unified {content, model, usage} schema instead.
+async def _proxy(request: Request, provider: str):
+    data = await request.json()
+    try:
+        data, report = compact_request(data)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    headers = report_headers(report) if report else {}
+    state = request.app.state
+    owner = session_key(request.session) if state.journal.enabled else None
+    if data.get("stream"):
+        response = await _stream(state, provider, data, request.session, owner)
+        response.headers.update(headers)
+        return response
+    complete = _complete_normalized if data.get("normalize") else _complete
+    status, body, cache_state = await complete(state, provider, data, request.session, owner)
+    if cache_state:
+        headers["X-Cache"] = cache_state
+    if isinstance(body, RawBody):
+        cached_tokens = cached_prompt_tokens(body.content)
+        if cached_tokens:
+            headers["X-Prompt-Cache-Read-Tokens"] = str(cached_tokens)
+        return Response(body.content, status_code=status, media_type=body.media_type, headers=headers)
+    return Response(dumps(body), status_code=status, media_type="application/json", headers=headers)
+
+# Proxy to OpenAI
+@app.post("/api/llm/openai")
+async def llm_openai(request: Request):
+    return await _proxy(request, "openai")
 
 # Proxy to Anthropic
 @app.post("/api/llm/anthropic")
 async def llm_anthropic(request: Request):
-    data = await request.json()
-    api_key = data.get("apiKey") or request.session.get("anthropic_apiKey") or os.environ.get("ANTHROPIC_API_KEY")
-    model = data.get("model") or request.session.get("anthropic_model") or "claude-3-opus-20240229"
-    if not api_key:
-        return JSONResponse({"error": "API key is required"}, status_code=400)
-    headers = {
-        "x-api-key": api_key,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
-    }
-    payload = {
-        "model": model,
-        "max_tokens": data.get("max_tokens", 1000),
-        "temperature": data.get("temperature", 0.7),
-        "messages": data.get("messages", []),
-    }
-    try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                "https://api.anthropic.com/v1/messages",
-                headers=headers,
-                json=payload,
-                timeout=60.0
-            )
-        resp.raise_for_status()
-        return resp.json()
-    except httpx.HTTPStatusError as e:
-        return JSONResponse({"error": e.response.text}, status_code=e.response.status_code)
-    except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
+    return await _proxy(request, "anthropic")
 
 # Proxy to Databricks
 @app.post("/api/llm/databricks")
 async def llm_databricks(request: Request):
+    return await _proxy(request, "databricks")
+
+# The caller's own journaled calls, newest first. Query: limit (<= 200), before
+# (the previous page's nextCursor), agent, provider, flowId, since/until (epoch seconds).
+@app.get("/api/llm/calls")
+async def llm_calls(request: Request):
+    journal = request.app.state.journal
+    if not journal.enabled:
+        return JSONResponse({"error": "The call journal is off; set LLM_JOURNAL_DIR"}, status_code=404)
+    params = request.query_params
+    try:
+        limit = min(max(int(params.get("limit") or 50), 1), 200)
+        before = int(params["before"]) if params.get("before") else None
+        since = float(params["since"]) if params.get("since") else None
+        until = float(params["until"]) if params.get("until") else None
+    except ValueError:
+        return JSONResponse({"error": "limit, before, since and until must be numbers"}, status_code=400)
+    owner = session_key(request.session)
+    if owner is None:
+        return {"calls": [], "nextCursor": None}
+    calls, cursor = await asyncio.to_thread(
+        journal.query, session=owner, flow_id=params.get("flowId"), agent=params.get("agent"),
+        provider=params.get("provider"), since=since, until=until, before=before, limit=limit)
+    return {"calls": calls, "nextCursor": cursor}
+
+# Run a list of mixed-provider requests concurrently; results stream back as
+# NDJSON lines tagged with their index, in completion order.
+@app.post("/api/llm/batch")
+async def llm_batch(request: Request):
     data = await request.json()
-    api_key = data.get("apiKey") or request.session.get("databricks_apiKey") or os.environ.get("DATABRICKS_API_KEY")
-    api_url = data.get("apiUrl") or request.session.get("databricks_apiUrl") or os.environ.get("DATABRICKS_API_URL")
-    model = data.get("model") or request.session.get("databricks_model") or "dbrx-instruct"
-    if not api_key or not api_url:
-        return JSONResponse({"error": "API key and API URL are required"}, status_code=400)
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": model,
-        "messages": data.get("messages", []),
-        "max_tokens": data.get("max_tokens", 1000),
-        "temperature": data.get("temperature", 0.7),
-    }
+    items = data.get("requests")
+    runner = request.app.state.batch
+    if not isinstance(items, list) or not items:
+        return JSONResponse({"error": "requests must be a non-empty list"}, status_code=400)
+    if len(items) > runner.max_items:
+        return JSONResponse({"error": f"At most {runner.max_items} requests per batch"}, status_code=400)
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                api_url,
-                headers=headers,
-                json=payload,
-                timeout=60.0
-            )
-        resp.raise_for_status()
-        return resp.json()
-    except httpx.HTTPStatusError as e:
-        return JSONResponse({"error": e.response.text}, status_code=e.response.status_code)
-    except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500) 
\ No newline at end of file
+        timeout = float(data.get("timeout") or runner.timeout)
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "timeout must be a number of seconds"}, status_code=400)
+    state = request.app.state
+    owner = session_key(request.session) if state.journal.enabled else None
+    session = dict(request.session)
+    # Items run concurrently, so their upstream time isn't this request's to subtract
+    current_timing.set(None)
+
+    async def call(provider, item):
+        complete = _complete_normalized if item.get("normalize") else _complete
+        try:
+            item, report = compact_request(item)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        status, body, _ = await complete(state, provider, dict(item, stream=False), session, owner)
+        # The per-item counterpart of the X-Prompt-Tokens-* headers
+        return status, body, {"compaction": report} if report else None
+
+    return RelayResponse(runner.run(items, call, timeout=timeout), media_type="application/x-ndjson")
+
+# Start a server-side Planner -> Researcher -> Writer -> Reviewer flow. Body:
+# {"goal": str, "agentLLMs": {"PlannerAgent": "openai", ...}, "llms": {"openai": {"model": ..., "apiUrl": ...}}}
+@app.post("/api/flows")
+async def start_flow(request: Request):
+    data = await request.json()
+    goal = (data.get("goal") or "").strip()
+    if not goal:
+        return JSONResponse({"error": "goal is required"}, status_code=400)
+    state = request.app.state
+    owner = session_key(request.session) if state.journal.enabled else None
+    session = dict(request.session)
+
+    async def call(provider, body):
+        status, result, _ = await _complete_normalized(state, provider, body, session, owner)
+        return status, result
+
+    try:
+        flow = state.flows.start(goal, call, data.get("agentLLMs"), data.get("llms"))
+    except FlowLimitExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    return {"id": flow.id, "status": flow.status}
+
+@app.get("/api/flows/{flow_id}")
+def get_flow(flow_id: str, request: Request):
+    flow = request.app.state.flows.get(flow_id)
+    if flow is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return flow.summary()
+
+# Bus events for one flow: everything emitted so far, then live events until the flow ends
+@app.websocket("/api/flows/{flow_id}/ws")
+async def flow_events(websocket: WebSocket, flow_id: str):
+    flow = websocket.app.state.flows.get(flow_id)
+    if flow is None:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    queue = flow.subscribe()
+    try:
+        while (record := await queue.get()) is not None:
+            await websocket.send_json(record)
+        await websocket.send_json({"event": "flowComplete", "message": flow.summary()})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        flow.unsubscribe(queue)
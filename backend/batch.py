@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+
+from providers import RawBody, loads
+from upstream import PROVIDERS
+
+
+def _env_number(name, default, cast):
+    value = os.environ.get(name)
+    return cast(value) if value not in (None, "") else default
+
+
+class BatchRunner:
+    """Fan a list of LLM requests out concurrently and yield results as they finish.
+
+    Each provider has its own concurrency cap, shared by every batch in the
+    process, so one slow or saturated provider never holds up the others.
+    """
+
+    def __init__(self, concurrency=None, max_items=64, timeout=120.0):
+        concurrency = concurrency or {}
+        self.limits = {p: asyncio.Semaphore(concurrency.get(p, 8)) for p in PROVIDERS}
+        self.max_items = max_items
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            concurrency={p: _env_number(f"{p.upper()}_BATCH_CONCURRENCY", 8, int) for p in PROVIDERS},
+            max_items=_env_number("LLM_BATCH_MAX_ITEMS", 64, int),
+            timeout=_env_number("LLM_BATCH_TIMEOUT", 120.0, float),
+        )
+
+    async def _run_one(self, index, item, call):
+        provider = _provider(item)
+        if provider not in self.limits:
+            return index, provider, 400, {"error": "Invalid provider"}, None
+        fields = None
+        try:
+            async with self.limits[provider]:
+                status, body, *extra = await call(provider, item)
+            fields = extra[0] if extra else None
+        except Exception as e:
+            status, body = 500, {"error": str(e)}
+        return index, provider, status, body, fields
+
+    async def run(self, items, call, timeout=None):
+        """Yield one NDJSON line per item, in completion order.
+
+        `call(provider, item)` returns `(status, body)`, or `(status, body,
+        fields)` where `fields` is a dict of extra keys for the item's line.
+        Items still running when the batch deadline passes are cancelled and
+        reported as 504.
+        """
+        timeout = min(timeout or self.timeout, self.timeout)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        tasks = {asyncio.ensure_future(self._run_one(i, item, call)): i for i, item in enumerate(items)}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(deadline - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    yield _line(*task.result())
+            for task in pending:
+                task.cancel()
+                index = tasks[task]
+                yield _line(index, _provider(items[index]), 504, {"error": "Batch deadline exceeded"})
+        finally:
+            # Also reached when the client disconnects mid-batch
+            for task in tasks:
+                task.cancel()
+
+
+def _provider(item):
+    return item.get("provider") if isinstance(item, dict) else None
+
+
+def _line(index, provider, status, body, fields=None):
+    head = json.dumps({"index": index, "provider": provider, "status": status, **(fields or {})})[:-1].encode()
+    if isinstance(body, RawBody) and body.media_type.startswith("application/json"):
+        # Splice the upstream JSON in instead of re-encoding it. Valid JSON has
+        # no bare line breaks inside strings, so dropping them only unfolds
+        # pretty-printed bodies onto the one line NDJSON allows.
+        content = body.content.strip().replace(b"\r", b"").replace(b"\n", b"")
+        try:
+            loads(content)
+        except ValueError:
+            pass
+        else:
+            return head + b', "body": ' + content + b"}\n"
+    if isinstance(body, RawBody):
+        body = body.content.decode(errors="replace")
+    return head + b', "body": ' + json.dumps(body).encode() + b"}\n"
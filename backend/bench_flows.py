@@ -0,0 +1,78 @@
+"""Run N server-side agent flows against a local mock provider and report flows/sec.
+
+    python bench_flows.py --flows 100 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from app import _complete_normalized, app
+from cache import ResponseCache
+from pipeline import FlowEngine
+from resilience import Resilience, ResilienceConfig
+from singleflight import SingleFlight
+from upstream import UpstreamClients
+
+
+def mock_transport(latency):
+    async def handler(request):
+        await asyncio.sleep(latency)
+        prompt = json.loads(request.content)["messages"][-1]["content"]
+        return httpx.Response(200, json={
+            "choices": [{"message": {"role": "assistant", "content": f"Mock reply to: {prompt[:200]}"}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 50, "total_tokens": len(prompt) // 4 + 50},
+        })
+    return httpx.MockTransport(handler)
+
+
+async def run(flows, latency, max_active, upstream_concurrency):
+    state = app.state
+    state.upstream = UpstreamClients(transport=mock_transport(latency))
+    state.cache = ResponseCache()
+    state.inflight = SingleFlight()
+    # Every flow shares one bench key, so its guard's concurrency limit bounds the run
+    config = ResilienceConfig(initial_concurrency=upstream_concurrency, max_concurrency=upstream_concurrency)
+    state.resilience = Resilience({"openai": config})
+    engine = FlowEngine(max_active=max_active)
+    session = {"openai_apiKey": "bench-key"}
+
+    async def call(provider, body):
+        status, result, _ = await _complete_normalized(state, provider, body, session)
+        return status, result
+
+    started = time.perf_counter()
+    # Distinct goals so nothing is coalesced or cached across flows
+    started_flows = [engine.start(f"Benchmark topic {i}", call) for i in range(flows)]
+    await asyncio.gather(*(engine.wait(flow.id) for flow in started_flows))
+    elapsed = time.perf_counter() - started
+    await state.upstream.aclose()
+    durations = sorted(flow.finished - flow.started for flow in started_flows)
+    return {
+        "flows": flows,
+        "completed": sum(flow.status == "completed" for flow in started_flows),
+        "upstreamLatency": latency,
+        "maxActive": max_active,
+        "upstreamConcurrency": upstream_concurrency,
+        "elapsed": round(elapsed, 3),
+        "flowsPerSecond": round(flows / elapsed, 2),
+        "flowP50": round(durations[len(durations) // 2], 3),
+        "flowMax": round(durations[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flows", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock upstream latency per call (s)")
+    parser.add_argument("--max-active", type=int, default=100)
+    parser.add_argument("--upstream-concurrency", type=int, default=100)
+    args = parser.parse_args()
+    result = asyncio.run(run(args.flows, args.latency, args.max_active, args.upstream_concurrency))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Per-request CPU cost of relaying an upstream completion body, by strategy.
+
+    python bench_passthrough.py --sizes 2000 200000 1000000 --iterations 200
+
+"parse+reencode" is what the handlers used to do (resp.json() then FastAPI's
+JSONResponse); "passthrough" is the current default; "normalize" is the
+optional unified-schema mode.
+"""
+import argparse
+import json
+import time
+
+from fastapi.responses import JSONResponse
+from starlette.responses import Response
+
+from providers import ADAPTERS, dumps, loads
+
+
+def completion(size):
+    content = ("The quick brown fox jumps over the lazy dog. " * (size // 45 + 1))[:size]
+    return json.dumps({
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1200, "completion_tokens": size // 4, "total_tokens": 1200 + size // 4},
+    }).encode()
+
+
+STRATEGIES = {
+    "parse+reencode": lambda raw: JSONResponse(json.loads(raw)).body,
+    "passthrough": lambda raw: Response(raw, media_type="application/json").body,
+    "normalize": lambda raw: Response(dumps(ADAPTERS["openai"].normalize(loads(raw))), media_type="application/json").body,
+}
+
+
+def measure(fn, raw, iterations):
+    fn(raw)
+    started = time.process_time()
+    for _ in range(iterations):
+        fn(raw)
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2_000, 200_000, 1_000_000])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    results = []
+    for size in args.sizes:
+        raw = completion(size)
+        row = {"bodyBytes": len(raw)}
+        row.update({name: round(measure(fn, raw, args.iterations), 1) for name, fn in STRATEGIES.items()})
+        row["savedMicros"] = round(row["parse+reencode"] - row["passthrough"], 1)
+        results.append(row)
+    print(json.dumps({"unit": "CPU microseconds per request", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from providers import RawBody
+
+# Values accepted in the request body's "cache" field
+CACHE_MODES = ("default", "use", "bypass", "refresh")
+
+
+def cache_key(provider, url, payload):
+    # Canonical JSON (sorted keys, no whitespace) so equal payloads hash equally
+    canonical = json.dumps([provider, url, payload], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def credential_digest(headers):
+    """Hash of the credential in upstream headers, so cached answers stay with the key that paid for them."""
+    secret = headers.get("Authorization") or headers.get("x-api-key") or ""
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def cache_mode(data, payload):
+    """Resolve how a request interacts with the cache: (read, write)."""
+    mode = data.get("cache") or "default"
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Invalid cache mode: {mode}")
+    if mode == "bypass" or data.get("stream"):
+        return False, False
+    if mode == "refresh":
+        return False, True
+    # Only deterministic calls are cached unless the client opts in
+    cacheable = mode == "use" or payload.get("temperature") == 0
+    return cacheable, cacheable
+
+
+class DiskTier:
+    """SQLite tier that keeps cached response bodies across restarts.
+
+    Writes from the event loop go to one background thread, in order, so the
+    request path never waits on SQLite. Expired and surplus rows are pruned
+    every `max_entries // 10` writes rather than on each one, so the tier can
+    overshoot its bound by about 10% between prunes. Reads use a connection
+    of their own: under WAL they never wait for the writer, not even while
+    it prunes.
+    """
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.prune_every = max(1, max_entries // 10)
+        self.write_errors = 0
+        self._writes = 0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache-disk")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_response_cache "
+            "(key TEXT PRIMARY KEY, body BLOB NOT NULL, media_type TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_response_cache_expires ON llm_response_cache (expires)")
+        self._read_lock = threading.Lock()
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+
+    def get(self, key, now):
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT body, media_type, expires FROM llm_response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        # Expired rows are left for the next prune
+        if row is None or row[2] <= now:
+            return None
+        return RawBody(row[0], row[1]), row[2]
+
+    def set(self, key, value, expires, now):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_response_cache (key, body, media_type, expires) VALUES (?, ?, ?, ?)",
+                (key, value.content, value.media_type, expires),
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune(now)
+
+    def _prune(self, now):
+        self._db.execute("DELETE FROM llm_response_cache WHERE expires <= ?", (now,))
+        # Oldest-expiring entries go first once the tier is over its bound
+        self._db.execute(
+            "DELETE FROM llm_response_cache WHERE key IN "
+            "(SELECT key FROM llm_response_cache ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def submit(self, method, *args):
+        """Run a write on the writer thread when called from the event loop, inline otherwise."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return method(*args)
+        self._writer.submit(method, *args).add_done_callback(self._written)
+
+    def _written(self, future):
+        # Nobody awaits writer futures; failures would otherwise vanish
+        if future.exception() is not None:
+            self.write_errors += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+
+    def close(self):
+        # Pending writes land before the database closes
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            self._db.close()
+        with self._read_lock:
+            self._reader.close()
+
+
+class ResponseCache:
+    """Size-bounded LRU of upstream responses with a TTL and an optional disk tier.
+
+    Values are RawBody instances: the upstream bytes are stored and replayed
+    without being parsed.
+    """
+
+    def __init__(self, max_entries=512, ttl=3600.0, path=None, disk_max_entries=10000, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self.disk = DiskTier(path, disk_max_entries) if path else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.writes = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 512)),
+            ttl=float(os.environ.get("LLM_CACHE_TTL", 3600)),
+            path=os.environ.get("LLM_CACHE_PATH") or None,
+            disk_max_entries=int(os.environ.get("LLM_CACHE_DISK_MAX_ENTRIES", 10000)),
+        )
+
+    def get(self, key):
+        """Cached value for `key`, or None. Reads the disk tier inline; on the event loop use aget()."""
+        now = self.clock()
+        value = self._get_memory(key, now)
+        if value is None and self.disk is not None:
+            value = self._promote(key, self.disk.get(key, now))
+        return self._count(value)
+
+    async def aget(self, key):
+        """get() for the event loop: a memory miss reads the disk tier on a worker thread."""
+        now = self.clock()
+        value = self._get_memory(key, now)
+        if value is None and self.disk is not None:
+            value = self._promote(key, await asyncio.to_thread(self.disk.get, key, now))
+        return self._count(value)
+
+    def _get_memory(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires > now:
+            self._entries.move_to_end(key)
+            return value
+        del self._entries[key]
+        self.expirations += 1
+        return None
+
+    def _promote(self, key, found):
+        if found is None:
+            return None
+        self._store(key, *found)
+        return found[0]
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        now = self.clock()
+        expires = now + self.ttl
+        self._store(key, value, expires)
+        if self.disk is not None:
+            self.disk.submit(self.disk.set, key, value, expires, now)
+        self.writes += 1
+
+    def _store(self, key, value, expires):
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+        if self.disk is not None:
+            self.disk.submit(self.disk.delete, key)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "writes": self.writes,
+            "size": len(self._entries),
+            "maxEntries": self.max_entries,
+            "ttl": self.ttl,
+            "disk": self.disk is not None,
+            "diskWriteErrors": self.disk.write_errors if self.disk is not None else 0,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
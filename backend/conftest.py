@@ -0,0 +1,47 @@
+import os
+
+import httpx
+import pytest
+
+# Keep the app's sessions in memory instead of the default backend/sessions.sqlite
+os.environ.setdefault("SESSION_STORE_PATH", "")
+
+
+# The proxy runs on asyncio (uvicorn); don't also run async tests under trio
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def mock_app(monkeypatch):
+    """Point the app at an in-process upstream, with fresh cache, coalescing and resilience state.
+
+    `mock_app(handler)` routes every upstream request to `handler`, an
+    httpx.MockTransport handler or a ready-made transport. `resilience` is a
+    ResilienceConfig applied to every provider; other keyword arguments
+    replace further app.state attributes (`metrics=Metrics()`, ...).
+    Returns app.state.
+    """
+    from app import app
+    from cache import ResponseCache
+    from resilience import Resilience
+    from singleflight import SingleFlight
+    from upstream import PROVIDERS, UpstreamClients
+
+    def install(handler, resilience=None, **state):
+        configs = {provider: resilience for provider in PROVIDERS} if resilience else None
+        if not isinstance(handler, httpx.AsyncBaseTransport):
+            handler = httpx.MockTransport(handler)
+        fresh = {
+            "upstream": UpstreamClients(transport=handler),
+            "cache": ResponseCache(),
+            "inflight": SingleFlight(),
+            "resilience": Resilience(configs),
+        }
+        fresh.update(state)
+        for name, value in fresh.items():
+            monkeypatch.setattr(app.state, name, value)
+        return app.state
+
+    return install
@@ -0,0 +1,320 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows: there, give each process its own directory
+    fcntl = None
+
+from providers import ADAPTERS, RawBody, dumps, loads
+
+# Fields of the proxy request body kept in the journal; credentials never are
+REQUEST_FIELDS = ("messages", "temperature", "max_tokens")
+
+
+def session_key(session):
+    """Journal owner id for a live server-side session; the cookie value itself is never stored."""
+    if not getattr(session, "live", False):
+        return None
+    return hashlib.sha256(session.sid.encode()).hexdigest()[:32]
+
+
+def _try_lock(f):
+    """Take the segment lock on open file `f` without waiting; False if a live writer holds it."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class Journal:
+    """Durable log of LLM calls: rotated NDJSON segments plus a SQLite index.
+
+    `record` only enqueues. A background task drains whatever has queued up
+    and writes it as one batch from a worker thread, so the request path
+    never waits on the disk. If the queue is full, records are dropped and
+    counted; they never apply backpressure to the proxy.
+
+    Several processes (uvicorn workers) can share a directory. Each appends
+    to its own segments, named with its pid and locked while open, and all
+    of them index into the one SQLite file, so a query sees every worker's
+    calls. Only segments that no live process holds are recovered or expired.
+    """
+
+    def __init__(self, directory=None, segment_bytes=16 * 1024 * 1024, segment_seconds=3600.0,
+                 max_segments=48, batch_size=512, queue_size=10000, clock=time.time):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.clock = clock
+        self._queue = None
+        self._task = None
+        self._lock = threading.Lock()
+        self._db = None
+        self._file = None
+        self._segment = None
+        self._segment_started = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.write_errors = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.environ.get("LLM_JOURNAL_DIR") or None,
+            segment_bytes=int(os.environ.get("LLM_JOURNAL_SEGMENT_BYTES", 16 * 1024 * 1024)),
+            segment_seconds=float(os.environ.get("LLM_JOURNAL_SEGMENT_SECONDS", 3600)),
+            max_segments=int(os.environ.get("LLM_JOURNAL_MAX_SEGMENTS", 48)),
+        )
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def open(self, recover=True):
+        """Open the index, and recover the newest segment unless another process owns the journal."""
+        if self._db is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.directory, "index.sqlite"),
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS calls (id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, "
+            "session TEXT, flow TEXT, agent TEXT, provider TEXT NOT NULL, "
+            "segment TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS calls_session_ts ON calls (session, ts)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS calls_flow ON calls (flow)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS calls_ts ON calls (ts)")
+        if recover:
+            self._recover()
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith("calls-"))
+
+    def _recover(self):
+        # Re-index lines that reached a segment but not the index (crash between the two).
+        # Each writer's segments are its own, so every segment a dead writer left is checked.
+        for segment in self._segments():
+            try:
+                f = open(os.path.join(self.directory, segment), "rb+")
+            except FileNotFoundError:  # expired by another worker meanwhile
+                continue
+            with f:
+                # Held means its writer is alive, and lines past the index are still on their way in
+                if _try_lock(f):
+                    self._recover_segment(segment, f)
+
+    def _recover_segment(self, segment, f):
+        row = self._db.execute("SELECT MAX(offset + length) FROM calls WHERE segment = ?", (segment,)).fetchone()
+        indexed = row[0] or 0
+        f.seek(indexed)
+        tail = f.read()
+        if not tail:
+            return
+        complete = tail.rfind(b"\n") + 1
+        # A torn final line is cut off
+        f.truncate(indexed + complete)
+        rows, offset = [], indexed
+        for line in tail[:complete].splitlines(keepends=True):
+            record = loads(line)
+            rows.append(self._index_row(record, segment, offset, len(line)))
+            offset += len(line)
+        self._insert(rows)
+
+    @staticmethod
+    def _index_row(record, segment, offset, length):
+        return (record["ts"], record.get("session"), record.get("flowId"), record.get("agent"),
+                record["provider"], segment, offset, length)
+
+    def _insert(self, rows):
+        self._db.execute("BEGIN")
+        self._db.executemany(
+            "INSERT INTO calls (ts, session, flow, agent, provider, segment, offset, length) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._db.execute("COMMIT")
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.open)
+        self._queue = asyncio.Queue(self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def aclose(self):
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def record(self, provider, data, session, owner, started, latency, status, body=None, cache_state=None,
+               usage=None, error=None):
+        """Queue one call made for `owner` (a session_key); `body` is the upstream RawBody or an error dict."""
+        if self._queue is None:
+            return
+        adapter = ADAPTERS[provider]
+        if error is None and isinstance(body, dict) and status != 200:
+            error = body.get("error")
+        try:
+            self._queue.put_nowait({
+                "ts": started,
+                "session": owner,
+                "flowId": data.get("flowId"),
+                "agent": data.get("agent"),
+                "provider": provider,
+                "model": adapter.resolve(data, session, "model") or adapter.default_model,
+                "stream": bool(data.get("stream")),
+                "status": status,
+                "cache": cache_state,
+                "latencyMs": round(latency * 1000, 1),
+                "usage": usage,
+                "error": error,
+                "request": {field: data[field] for field in REQUEST_FIELDS if field in data},
+                "response": body if isinstance(body, RawBody) else None,
+            })
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _run(self):
+        while True:
+            record = await self._queue.get()
+            batch = []
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= self.batch_size or self._queue.empty():
+                    break
+                record = self._queue.get_nowait()
+            if batch:
+                try:
+                    await asyncio.to_thread(self._write, batch)
+                except Exception:
+                    self.write_errors += len(batch)
+            if record is None:
+                return
+
+    @staticmethod
+    def _finish(record):
+        # Parsing the upstream body happens here, on the writer thread, never on the request path
+        body = record.pop("response")
+        record["response"] = None
+        if body is not None:
+            try:
+                normalized = ADAPTERS[record["provider"]].normalize(body.json(), record["model"])
+                record["response"] = normalized["content"]
+                record["usage"] = record["usage"] or normalized["usage"]
+            except Exception:
+                record["response"] = body.content.decode("utf-8", "replace")
+        return record
+
+    def _write(self, batch):
+        with self._lock:
+            self._rotate()
+            offset = self._file.tell()
+            lines, rows = [], []
+            for record in batch:
+                line = dumps(self._finish(record)) + b"\n"
+                rows.append(self._index_row(record, self._segment, offset, len(line)))
+                lines.append(line)
+                offset += len(line)
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            self._insert(rows)
+            self.written += len(batch)
+
+    def _rotate(self):
+        now = self.clock()
+        if self._file is not None and (self._file.tell() < self.segment_bytes
+                                       and now - self._segment_started < self.segment_seconds):
+            return
+        if self._file is not None:
+            self._file.close()
+        # Zero-padded milliseconds so segment names sort by age; the pid keeps workers apart
+        self._segment = f"calls-{int(now * 1000):015d}-{os.getpid()}.jsonl"
+        self._segment_started = now
+        self._file = open(os.path.join(self.directory, self._segment), "ab")
+        if fcntl is not None:
+            # Blocks only while another worker is recovering this (new, empty) file
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        for old in self._segments()[:-self.max_segments]:
+            self._expire(old)
+
+    def _expire(self, segment):
+        path = os.path.join(self.directory, segment)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:  # another worker got there first
+            return
+        with f:
+            # Another worker's current segment is left to that worker
+            if not _try_lock(f):
+                return
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+        self._db.execute("DELETE FROM calls WHERE segment = ?", (segment,))
+
+    def query(self, session=None, flow_id=None, agent=None, provider=None, since=None, until=None,
+              before=None, limit=50):
+        """Newest-first page of records plus the cursor for the next page (None at the end)."""
+        filters, params = [], []
+        for column, value in (("session", session), ("flow", flow_id), ("agent", agent), ("provider", provider)):
+            if value is not None:
+                filters.append(f"{column} = ?")
+                params.append(value)
+        for clause, value in (("ts >= ?", since), ("ts < ?", until), ("id < ?", before)):
+            if value is not None:
+                filters.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, segment, offset, length FROM calls {where} ORDER BY id DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        records = []
+        handles = {}
+        try:
+            for call_id, segment, offset, length in rows:
+                f = handles.get(segment)
+                if f is None:
+                    f = handles[segment] = open(os.path.join(self.directory, segment), "rb")
+                f.seek(offset)
+                records.append(dict(loads(f.read(length)), id=call_id))
+        except FileNotFoundError:  # rotated away between the index read and the file read
+            pass
+        finally:
+            for f in handles.values():
+                f.close()
+        return records, (rows[-1][0] if len(rows) == limit else None)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "written": self.written,
+            "dropped": self.dropped,
+            "writeErrors": self.write_errors,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "segment": self._segment,
+        }
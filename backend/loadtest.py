@@ -0,0 +1,320 @@
+"""Load-test the proxy under uvicorn against the local mock provider and save the results as JSON.
+
+    python loadtest.py --provider openai --concurrency 50 --requests 2000
+    python loadtest.py --provider anthropic --stream --token-rate 200
+    python loadtest.py --compare loadtest-results/before.json loadtest-results/after.json
+
+The mock provider and the app each run in their own process. The same workload
+is first sent straight to the mock (the baseline), then through the proxy.
+Proxy overhead is the latency difference between the two runs, alongside the
+app's own llm_proxy_overhead_seconds. Memory per connection is the app's
+RSS growth under load divided by the number of concurrent clients.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import httpx
+
+from providers import ADAPTERS
+from streaming import stream_payload
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MOCK_PATHS = {
+    "openai": "/v1/chat/completions",
+    "anthropic": "/v1/messages",
+    "databricks": "/serving-endpoints/mock/invocations",
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_kb(pid):
+    # Linux only; other platforms report memory as null
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, ttfbs, statuses, elapsed):
+    ms = lambda v: None if v is None else round(v * 1000, 2)
+    ok = [lat for lat, status in zip(latencies, statuses) if status == 200]
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    result = {
+        "requests": len(latencies),
+        "errors": len(latencies) - len(ok),
+        "statusCounts": counts,
+        "elapsed": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "meanMs": ms(sum(ok) / len(ok)) if ok else None,
+        "p50Ms": ms(percentile(ok, 50)),
+        "p95Ms": ms(percentile(ok, 95)),
+        "p99Ms": ms(percentile(ok, 99)),
+    }
+    if ttfbs:
+        result["ttfbP50Ms"] = ms(percentile(ttfbs, 50))
+        result["ttfbP95Ms"] = ms(percentile(ttfbs, 95))
+        result["ttfbP99Ms"] = ms(percentile(ttfbs, 99))
+    return result
+
+
+async def drive(url, build, total, concurrency, stream, headers=None):
+    """Send `total` requests from `concurrency` concurrent clients; returns the summary."""
+    latencies, ttfbs, statuses = [], [], []
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def worker(client):
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                if stream:
+                    async with client.stream("POST", url, json=build(i), headers=headers) as resp:
+                        first = None
+                        async for _ in resp.aiter_bytes():
+                            first = first or time.perf_counter()
+                        if first and resp.status_code == 200:
+                            ttfbs.append(first - started)
+                        status = resp.status_code
+                else:
+                    resp = await client.post(url, json=build(i), headers=headers)
+                    status = resp.status_code
+            except httpx.HTTPError:
+                status = 599
+            latencies.append(time.perf_counter() - started)
+            statuses.append(status)
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, ttfbs, statuses, elapsed)
+
+
+async def wait_ready(url, process, timeout=20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with status {process.returncode}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def overhead_totals(metrics_text, provider):
+    # (sum, count) of llm_proxy_overhead_seconds for this provider, across its models
+    total = count = 0.0
+    for line in metrics_text.splitlines():
+        if line.startswith("llm_proxy_overhead_seconds_") and f'provider="{provider}"' in line:
+            value = float(line.rsplit(" ", 1)[1])
+            if line.startswith("llm_proxy_overhead_seconds_sum"):
+                total += value
+            elif line.startswith("llm_proxy_overhead_seconds_count"):
+                count += value
+    return total, count
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@asynccontextmanager
+async def serve(args, concurrency):
+    """Run the mock provider and the app (every provider pointed at the mock) for the block.
+
+    Yields (app_base, mock_base, app_process).
+    """
+    mock_port, app_port = free_port(), free_port()
+    mock_base = f"http://127.0.0.1:{mock_port}"
+    app_base = f"http://127.0.0.1:{app_port}"
+    mock = subprocess.Popen([
+        sys.executable, "mock_provider.py", "--port", str(mock_port), "--latency", str(args.latency),
+        "--token-rate", str(args.token_rate), "--tokens", str(args.tokens),
+        "--error-rate", str(args.error_rate), "--error-status", str(args.error_status), "--seed", "1",
+    ], cwd=HERE)
+    env = dict(os.environ)
+    for provider, path in MOCK_PATHS.items():
+        env[f"{provider.upper()}_API_URL"] = mock_base + path
+        env[f"{provider.upper()}_API_KEY"] = "loadtest-key"
+    # Let the adaptive limit start at the offered load rather than ramp up to it;
+    # explicit settings in the environment still win
+    env.setdefault("LLM_INITIAL_CONCURRENCY", str(concurrency))
+    env.setdefault("LLM_MAX_CONCURRENCY", str(max(concurrency, 64)))
+    env.setdefault("LLM_HTTP_MAX_KEEPALIVE", str(concurrency))
+    app = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app:app", "--port", str(app_port),
+        "--log-level", "warning", "--no-access-log",
+    ], cwd=HERE, env=env)
+    try:
+        await wait_ready(mock_base + "/health", mock)
+        await wait_ready(app_base + "/api/health", app)
+        yield app_base, mock_base, app
+    finally:
+        for process in (app, mock):
+            process.terminate()
+        for process in (app, mock):
+            process.wait(10)
+
+
+async def run(args):
+    async with serve(args, args.concurrency) as (app_base, mock_base, app):
+        mock_url = mock_base + MOCK_PATHS[args.provider]
+        adapter = ADAPTERS[args.provider]
+        model = args.model or adapter.default_model
+
+        def proxy_body(i):
+            # Distinct prompts so nothing is cached or coalesced
+            return {"messages": [{"role": "user", "content": f"Load test request {i}"}],
+                    "model": model, "stream": args.stream}
+
+        def direct_body(i):
+            payload = adapter.payload(proxy_body(i), model)
+            return stream_payload(args.provider, payload) if args.stream else payload
+
+        # Warm both paths so connection setup isn't measured
+        await drive(mock_url, direct_body, args.concurrency, args.concurrency, args.stream,
+                    adapter.headers("loadtest-key"))
+        await drive(f"{app_base}/api/llm/{args.provider}", proxy_body, args.concurrency, args.concurrency, args.stream)
+
+        direct = await drive(mock_url, direct_body, args.requests, args.concurrency, args.stream,
+                             adapter.headers("loadtest-key"))
+        async with httpx.AsyncClient() as client:
+            before = await client.get(f"{app_base}/api/metrics")
+        idle_rss = rss_kb(app.pid)
+        peak_rss = idle_rss
+
+        async def sample_rss():
+            nonlocal peak_rss
+            while True:
+                current = rss_kb(app.pid)
+                if current is not None:
+                    peak_rss = max(peak_rss or 0, current)
+                await asyncio.sleep(0.05)
+
+        sampler = asyncio.create_task(sample_rss())
+        proxied = await drive(f"{app_base}/api/llm/{args.provider}", proxy_body, args.requests,
+                              args.concurrency, args.stream)
+        sampler.cancel()
+        async with httpx.AsyncClient() as client:
+            after = await client.get(f"{app_base}/api/metrics")
+
+    (sum_before, count_before), (sum_after, count_after) = (
+        overhead_totals(before.text, args.provider), overhead_totals(after.text, args.provider))
+    runs = count_after - count_before
+    server_mean = round((sum_after - sum_before) / runs * 1000, 3) if runs else None
+    delta = lambda key: None if direct[key] is None or proxied[key] is None else round(proxied[key] - direct[key], 2)
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {
+            "provider": args.provider, "model": model, "stream": args.stream,
+            "concurrency": args.concurrency, "requests": args.requests,
+            "latency": args.latency, "tokenRate": args.token_rate, "tokens": args.tokens,
+            "errorRate": args.error_rate, "errorStatus": args.error_status,
+        },
+        "direct": direct,
+        "proxy": proxied,
+        "overhead": {
+            "p50Ms": delta("p50Ms"),
+            "p95Ms": delta("p95Ms"),
+            "p99Ms": delta("p99Ms"),
+            "meanMs": delta("meanMs"),
+            "serverMeanMs": server_mean,
+        },
+        "memory": {
+            "idleRssKb": idle_rss,
+            "peakRssKb": peak_rss,
+            "perConnectionKb": round((peak_rss - idle_rss) / args.concurrency, 1) if idle_rss else None,
+        },
+    }
+
+
+def flatten(result, prefix=""):
+    for key, value in result.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = dict(flatten(json.load(f)))
+    with open(after_path) as f:
+        after = dict(flatten(json.load(f)))
+    print(f"{'metric':<32} {'before':>12} {'after':>12} {'change':>9}")
+    for key, old in before.items():
+        if key.startswith("config.") or key not in after:
+            continue
+        new = after[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else ""
+        print(f"{key:<32} {old:>12} {new:>12} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--provider", choices=sorted(MOCK_PATHS), default="openai")
+    parser.add_argument("--model")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock time to first byte (s)")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="mock tokens/s; 0 = instant")
+    parser.add_argument("--tokens", type=int, default=50, help="mock completion length")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--output", help="results file (default loadtest-results/<time>-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="diff two results files and exit")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    result = asyncio.run(run(args))
+    output = args.output or os.path.join(
+        HERE, "loadtest-results", f"{datetime.now():%Y%m%d-%H%M%S}-{result['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+import httpx
+
+from resilience import CircuitOpen, LimitExceeded
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Distinct model labels kept per provider; anything beyond is folded into "other"
+MAX_MODELS_PER_PROVIDER = 32
+
+# Shorter profiler intervals would have the sampler thread fighting the event loop for the GIL
+MIN_PROFILE_INTERVAL = 0.001
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Series:
+    """All metrics for one (provider, model) pair, allocated once and reused."""
+
+    __slots__ = ("labels", "requests", "errors", "upstream", "ttfb", "overhead",
+                 "request_bytes", "response_bytes", "prompt_tokens", "completion_tokens")
+
+    def __init__(self, provider, model):
+        self.labels = f'provider="{_escape(provider)}",model="{_escape(model)}"'
+        self.requests = 0
+        self.errors = Counter()
+        self.upstream = Histogram(LATENCY_BUCKETS)
+        self.ttfb = Histogram(LATENCY_BUCKETS)
+        self.overhead = Histogram(LATENCY_BUCKETS)
+        self.request_bytes = Histogram(BYTES_BUCKETS)
+        self.response_bytes = Histogram(BYTES_BUCKETS)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def usage(self, prompt, completion):
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Timing:
+    """Per-request scratch space shared between the middleware and the handlers."""
+
+    __slots__ = ("series", "upstream")
+
+    def __init__(self):
+        self.series = None
+        self.upstream = 0.0
+
+
+current_timing = ContextVar("current_timing", default=None)
+
+
+def error_class(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        if status == 429:
+            return "rate_limited"
+        return "upstream_5xx" if status >= 500 else "upstream_4xx"
+    if isinstance(error, CircuitOpen):
+        return "circuit_open"
+    if isinstance(error, LimitExceeded):
+        return "queue_timeout"
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.TransportError):
+        return "transport"
+    return "internal"
+
+
+_USAGE_FIELDS = re.compile(rb'"(prompt_tokens|completion_tokens|input_tokens|output_tokens)"\s*:\s*(\d+)')
+
+
+def scan_usage(content):
+    """Token counts from a raw JSON body without parsing the whole thing.
+
+    Providers put `usage` near the end of the body, so only the tail from the
+    last "usage" key is scanned.
+    """
+    start = content.rfind(b'"usage"')
+    if start < 0:
+        return 0, 0
+    found = dict(_USAGE_FIELDS.findall(content, start))
+    prompt = int(found.get(b"prompt_tokens") or found.get(b"input_tokens") or 0)
+    completion = int(found.get(b"completion_tokens") or found.get(b"output_tokens") or 0)
+    return prompt, completion
+
+
+def observe_upstream(series, started):
+    """Record time spent waiting on the provider since `started` (perf_counter)."""
+    elapsed = time.perf_counter() - started
+    series.upstream.observe(elapsed)
+    timing = current_timing.get()
+    if timing is not None:
+        timing.upstream += elapsed
+
+
+class Metrics:
+    def __init__(self):
+        self._series = {}
+        self._models = Counter()
+        self.profiler = SamplingProfiler()
+
+    def series(self, provider, model):
+        key = (provider, model)
+        series = self._series.get(key)
+        if series is None:
+            if self._models[provider] >= MAX_MODELS_PER_PROVIDER:
+                key = (provider, "other")
+                series = self._series.get(key)
+                if series is not None:
+                    return series
+                model = "other"
+            self._models[provider] += 1
+            series = self._series[key] = Series(provider, model)
+        return series
+
+    def call(self, provider, model):
+        """Count one LLM call and attribute the current request's overhead to it."""
+        series = self.series(provider, model)
+        series.requests += 1
+        timing = current_timing.get()
+        if timing is not None and timing.series is None:
+            timing.series = series
+        return series
+
+    def render(self, extra=()):
+        """Prometheus text exposition format."""
+        out = []
+        all_series = list(self._series.values())
+
+        def counter(name, help_text, value_of):
+            out.append(f"# HELP {name} {help_text}\n# TYPE {name} counter\n")
+            for s in all_series:
+                out.append(f"{name}{{{s.labels}}} {value_of(s)}\n")
+
+        def histogram(name, help_text, hist_of):
+            out.append(f"# HELP {name} {help_text}\n# TYPE {name} histogram\n")
+            for s in all_series:
+                hist = hist_of(s)
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    out.append(f'{name}_bucket{{{s.labels},le="{bound}"}} {cumulative}\n')
+                out.append(f'{name}_bucket{{{s.labels},le="+Inf"}} {hist.count}\n')
+                out.append(f"{name}_sum{{{s.labels}}} {hist.sum}\n{name}_count{{{s.labels}}} {hist.count}\n")
+
+        counter("llm_proxy_requests_total", "LLM calls handled by the proxy.", lambda s: s.requests)
+        out.append("# HELP llm_proxy_errors_total Failed LLM calls by error class.\n"
+                   "# TYPE llm_proxy_errors_total counter\n")
+        for s in all_series:
+            for cls, count in s.errors.items():
+                out.append(f'llm_proxy_errors_total{{{s.labels},class="{cls}"}} {count}\n')
+        histogram("llm_proxy_upstream_seconds", "Time spent waiting on the provider.", lambda s: s.upstream)
+        histogram("llm_proxy_ttfb_seconds", "Time to the first streamed delta.", lambda s: s.ttfb)
+        histogram("llm_proxy_overhead_seconds", "Request time not spent waiting on the provider.", lambda s: s.overhead)
+        histogram("llm_proxy_request_bytes", "Proxy request body size.", lambda s: s.request_bytes)
+        histogram("llm_proxy_response_bytes", "Upstream response body size.", lambda s: s.response_bytes)
+        counter("llm_proxy_prompt_tokens_total", "Prompt tokens reported by providers.", lambda s: s.prompt_tokens)
+        counter("llm_proxy_completion_tokens_total", "Completion tokens reported by providers.",
+                lambda s: s.completion_tokens)
+        for name, help_text, value in extra:
+            out.append(f"# HELP {name} {help_text}\n# TYPE {name} gauge\n{name} {value}\n")
+        return "".join(out)
+
+
+class MetricsMiddleware:
+    """Times /api/llm/* requests end to end and records proxy overhead.
+
+    Handlers add the time they spend waiting upstream to the request's
+    Timing (see `Metrics.call` and `observe_upstream`); whatever remains of
+    the total is overhead. Only POSTs to `prefix + route` for the given
+    routes are measured, so arbitrary paths can't mint new label values.
+    """
+
+    def __init__(self, app, routes, prefix="/api/llm/"):
+        self.app = app
+        self.paths = {prefix + route: route for route in routes}
+
+    async def __call__(self, scope, receive, send):
+        # Only the proxy calls; reads such as GET /api/llm/calls and unknown paths aren't LLM traffic
+        route = self.paths.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if route is None:
+            return await self.app(scope, receive, send)
+        timing = Timing()
+        token = current_timing.set(timing)
+        received = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, send)
+        finally:
+            current_timing.reset(token)
+            series = timing.series
+            if series is None:
+                # Routes that fan out (batch) have no single upstream wait to subtract
+                series = scope["app"].state.metrics.series(route, "-")
+            else:
+                series.overhead.observe(max(time.perf_counter() - started - timing.upstream, 0.0))
+            series.request_bytes.observe(received)
+
+
+class StreamObserver:
+    """Collects time-to-first-delta, bytes and usage for one streamed call.
+
+    `done(usage, error)`, when given, runs once the stream has ended.
+    """
+
+    __slots__ = ("series", "started", "first", "sent", "done")
+
+    def __init__(self, series, started, done=None):
+        self.series = series
+        self.started = started
+        self.first = None
+        self.sent = 0
+        self.done = done
+
+    def chunk(self, size):
+        if self.first is None:
+            self.first = time.perf_counter()
+            self.series.ttfb.observe(self.first - self.started)
+        self.sent += size
+
+    def finish(self, usage, error=None):
+        observe_upstream(self.series, self.started)
+        self.series.response_bytes.observe(self.sent)
+        self.series.usage(usage.get("promptTokens", 0), usage.get("completionTokens", 0))
+        if error is not None:
+            self.series.errors[error_class(error)] += 1
+        if self.done is not None:
+            self.done(usage, error)
+
+
+class SamplingProfiler:
+    """Low-rate stack sampler for the event loop thread, switchable at runtime.
+
+    Samples are aggregated as collapsed stacks ("a;b;c count"), the input
+    format of flamegraph tools.
+    """
+
+    def __init__(self):
+        self.samples = Counter()
+        self.interval = 0.005
+        # samples is written by the sampler thread and read on the event loop
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None, thread_id=None):
+        """Start sampling `thread_id` (default: the caller's thread) every `interval` seconds.
+
+        Raises ValueError for an interval that isn't a positive number; short
+        ones are raised to MIN_PROFILE_INTERVAL.
+        """
+        if interval is not None:
+            if not 0 < interval < float("inf"):
+                raise ValueError("interval must be a positive number of seconds")
+            interval = max(interval, MIN_PROFILE_INTERVAL)
+        if self.running:
+            return
+        self.interval = interval or self.interval
+        self._target = thread_id or threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="llm-proxy-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                with self._lock:
+                    self.samples[key] += 1
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+
+    def collapsed(self, limit=200):
+        with self._lock:
+            top = self.samples.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in top)
+
+    def status(self):
+        with self._lock:
+            samples = sum(self.samples.values())
+        return {"running": self.running, "interval": self.interval, "samples": samples}
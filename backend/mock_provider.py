@@ -0,0 +1,194 @@
+"""Local stand-in for the OpenAI, Anthropic and Databricks chat APIs, streaming included.
+
+    python mock_provider.py --port 9100 --latency 0.05 --token-rate 200 --error-rate 0.01
+
+Point the backend at it with
+    OPENAI_API_URL=http://127.0.0.1:9100/v1/chat/completions
+    ANTHROPIC_API_URL=http://127.0.0.1:9100/v1/messages
+    DATABRICKS_API_URL=http://127.0.0.1:9100/serving-endpoints/mock/invocations
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.05       # seconds before the first byte
+    token_rate: float = 0.0     # completion tokens per second; 0 sends them all at once
+    tokens: int = 50            # completion length, capped by the request's max_tokens
+    error_rate: float = 0.0     # fraction of requests answered with error_status
+    error_status: int = 500
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency=float(os.environ.get("MOCK_LATENCY", cls.latency)),
+            token_rate=float(os.environ.get("MOCK_TOKEN_RATE", cls.token_rate)),
+            tokens=int(os.environ.get("MOCK_TOKENS", cls.tokens)),
+            error_rate=float(os.environ.get("MOCK_ERROR_RATE", cls.error_rate)),
+            error_status=int(os.environ.get("MOCK_ERROR_STATUS", cls.error_status)),
+        )
+
+
+def _prompt_tokens(messages):
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4 + 1
+
+
+def _completion_tokens(config, body):
+    # Like the real APIs, never answer with more than the request's max_tokens
+    return min(config.tokens, body.get("max_tokens") or config.tokens)
+
+
+def _words(count):
+    return [f"token{i} " for i in range(count)]
+
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n".encode()
+
+
+def create_app(config=None):
+    config = config or MockConfig()
+    rng = random.Random(config.seed)
+    mock = FastAPI()
+    mock.state.config = config
+    mock.state.requests = 0
+
+    async def generate(words):
+        # Emits one word per tick at the configured token rate
+        for word in words:
+            if config.token_rate:
+                await asyncio.sleep(1 / config.token_rate)
+            yield word
+
+    async def admit():
+        """Common latency and error injection; returns an error response or None."""
+        mock.state.requests += 1
+        await asyncio.sleep(config.latency)
+        if config.error_rate and rng.random() < config.error_rate:
+            headers = {"Retry-After": "1"} if config.error_status == 429 else None
+            return JSONResponse({"error": {"type": "mock_error", "message": "injected failure"}},
+                                status_code=config.error_status, headers=headers)
+        return None
+
+    async def openai_format(request: Request):
+        body = await request.json()
+        if (error := await admit()) is not None:
+            return error
+        model = body.get("model", "mock-model")
+        words = _words(_completion_tokens(config, body))
+        prompt = _prompt_tokens(body.get("messages", []))
+        usage = {"prompt_tokens": prompt, "completion_tokens": len(words), "total_tokens": prompt + len(words)}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        if not body.get("stream"):
+            if config.token_rate:
+                await asyncio.sleep(len(words) / config.token_rate)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        async def events():
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "model": model}
+            yield _sse(dict(chunk, choices=[{"index": 0, "delta": {"role": "assistant"}}]))
+            async for word in generate(words):
+                yield _sse(dict(chunk, choices=[{"index": 0, "delta": {"content": word}}]))
+            yield _sse(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield _sse(dict(chunk, choices=[], usage=usage))
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @mock.post("/v1/chat/completions")
+    async def openai(request: Request):
+        return await openai_format(request)
+
+    # Databricks model serving speaks the chat-completions format
+    @mock.post("/serving-endpoints/{name}/invocations")
+    async def databricks(name: str, request: Request):
+        return await openai_format(request)
+
+    @mock.post("/v1/messages")
+    async def anthropic(request: Request):
+        body = await request.json()
+        if (error := await admit()) is not None:
+            return error
+        model = body.get("model", "mock-model")
+        words = _words(_completion_tokens(config, body))
+        prompt = _prompt_tokens(body.get("messages", []))
+        message_id = f"msg_{uuid.uuid4().hex[:12]}"
+        if not body.get("stream"):
+            if config.token_rate:
+                await asyncio.sleep(len(words) / config.token_rate)
+            return JSONResponse({
+                "id": message_id,
+                "type": "message",
+                "role": "assistant",
+                "model": model,
+                "content": [{"type": "text", "text": "".join(words)}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": prompt, "output_tokens": len(words)},
+            })
+
+        async def events():
+            yield _sse({"type": "message_start", "message": {
+                "id": message_id, "type": "message", "role": "assistant", "model": model, "content": [],
+                "usage": {"input_tokens": prompt, "output_tokens": 0},
+            }}, "message_start")
+            yield _sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+                       "content_block_start")
+            async for word in generate(words):
+                yield _sse({"type": "content_block_delta", "index": 0,
+                            "delta": {"type": "text_delta", "text": word}}, "content_block_delta")
+            yield _sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+            yield _sse({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                        "usage": {"output_tokens": len(words)}}, "message_delta")
+            yield _sse({"type": "message_stop"}, "message_stop")
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @mock.get("/health")
+    def health():
+        return {"status": "ok", "requests": mock.state.requests}
+
+    return mock
+
+
+def main():
+    import uvicorn
+
+    defaults = MockConfig.from_env()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=defaults.latency)
+    parser.add_argument("--token-rate", type=float, default=defaults.token_rate)
+    parser.add_argument("--tokens", type=int, default=defaults.tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    config = MockConfig(args.latency, args.token_rate, args.tokens, args.error_rate, args.error_status, args.seed)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
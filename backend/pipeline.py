@@ -0,0 +1,275 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+# Same system prompts the browser agents use (frontend/src/services/openai.ts)
+AGENT_PROMPTS = {
+    "planner": "You are a planning agent responsible for breaking down tasks into actionable steps.\n"
+               "Your goal is to create clear, logical, and efficient plans that can be executed by other agents.\n"
+               "Focus on identifying key objectives, dependencies, and potential challenges.\n"
+               "Format your response in a clear, structured manner.\n\n"
+               "IMPORTANT: Always include a suggested article title and 3-5 section subtitles in your plan.",
+    "researcher": "You are a research agent responsible for gathering and synthesizing information.\n"
+                  "Your goal is to provide comprehensive, accurate, and relevant information to support content creation.\n"
+                  "Focus on finding credible sources, key facts, and important context.\n"
+                  "Format your response in a clear, organized manner with proper citations where applicable.\n\n"
+                  "IMPORTANT: Suggest a title and section subtitles for the article based on your research.",
+    "writer": "You are a writing agent responsible for creating engaging and informative content.\n"
+              "Your goal is to transform research and plans into well-structured, compelling content.\n"
+              "Focus on clarity, flow, and maintaining a consistent voice throughout the piece.\n"
+              "Format your response in a professional, polished manner with proper paragraphs and structure.\n\n"
+              "IMPORTANT: Begin your output with a title and section subtitles, then write the content for each section.",
+    "reviewer": "You are a review agent responsible for providing constructive feedback on content.\n"
+                "Your goal is to ensure the content meets quality standards and effectively communicates its message.\n"
+                "Focus on identifying areas for improvement in clarity, accuracy, structure, and style.\n"
+                "Format your feedback in a clear, actionable manner with specific suggestions for improvement.",
+}
+
+
+class FlowLimitExceeded(Exception):
+    """Too many flows are already queued or running to accept another."""
+
+    status_code = 429
+
+
+@dataclass
+class Stage:
+    name: str
+    agent: str
+    receiver: str
+    event: str
+    prompt: Callable[[dict], list]
+    depends_on: tuple = ()
+
+
+def _messages(role, user):
+    return [{"role": "system", "content": AGENT_PROMPTS[role]}, {"role": "user", "content": user}]
+
+
+# Planner -> Researcher -> Writer -> Reviewer -> Writer (revision), emitting the
+# same bus events as the browser agents. `outputs` maps stage name to its text,
+# plus "goal" for the user's input. Every stage needs the one before it, so
+# this chain runs one stage at a time; concurrency comes from running many
+# flows, or from custom stage graphs with independent branches.
+DEFAULT_STAGES = (
+    Stage("plan", "PlannerAgent", "ResearchAgent", "planReady",
+          lambda o: _messages("planner", o["goal"])),
+    Stage("research", "ResearchAgent", "WriterAgent", "researchReady",
+          lambda o: _messages("researcher", f"Research the following plan: {o['plan']}"), ("plan",)),
+    Stage("draft", "WriterAgent", "ReviewerAgent", "draftReady",
+          lambda o: _messages("writer", f"Create content based on this research: {o['research']}"), ("research",)),
+    Stage("review", "ReviewerAgent", "WriterAgent", "reviewComplete",
+          lambda o: _messages("reviewer", f"Review this content: {o['draft']}"), ("draft",)),
+    Stage("rewrite", "WriterAgent", "User", "rewriteComplete",
+          lambda o: _messages("writer", f"Revise the following content based on this feedback: {o['review']}"
+                                        f"\n\nOriginal content: {o['draft']}"), ("draft", "review")),
+)
+
+
+def validate_stages(stages):
+    names = {stage.name for stage in stages}
+    if len(names) != len(stages):
+        raise ValueError("Stage names must be unique")
+    for stage in stages:
+        missing = set(stage.depends_on) - names
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {sorted(missing)}")
+    # Kahn's algorithm: every stage must become runnable eventually
+    done = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [s for s in remaining if set(s.depends_on) <= done]
+        if not ready:
+            raise ValueError("Stage graph has a cycle")
+        done.update(s.name for s in ready)
+        remaining = [s for s in remaining if s.name not in done]
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Flow:
+    def __init__(self, goal, agent_llms, llms, stages):
+        self.id = str(uuid.uuid4())
+        self.goal = goal
+        self.agent_llms = agent_llms
+        self.llms = llms
+        self.stages = stages
+        self.status = "pending"
+        self.error = None
+        self.outputs = {"goal": goal}
+        self.events = []
+        self.started = None
+        self.finished = None
+        self._subscribers = set()
+
+    def emit(self, event, message):
+        record = {"event": event, "message": message}
+        self.events.append(record)
+        for queue in self._subscribers:
+            queue.put_nowait(record)
+
+    def subscribe(self):
+        """Queue receiving every past and future event; None marks the end."""
+        queue = asyncio.Queue()
+        for record in self.events:
+            queue.put_nowait(record)
+        if self.done:
+            queue.put_nowait(None)
+        else:
+            self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    @property
+    def done(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    def _close(self, status):
+        self.status = status
+        self.finished = time.monotonic()
+        for queue in self._subscribers:
+            queue.put_nowait(None)
+        self._subscribers.clear()
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "goal": self.goal,
+            "status": self.status,
+            "error": self.error,
+            "outputs": {k: v for k, v in self.outputs.items() if k != "goal"},
+            "elapsed": (self.finished or time.monotonic()) - self.started if self.started else None,
+        }
+
+
+class FlowEngine:
+    """Runs many agent flows per process as asyncio DAGs over the provider proxies.
+
+    Each flow gets a `call(provider, data)` coroutine that performs one
+    non-streaming LLM call with a per-provider request body and returns
+    `(status, body)`, body being the normalized {content, model, usage} reply.
+    At most `max_active` flows run at once and the rest queue; once
+    `max_in_flight` flows are queued or running, new ones are refused. Memory
+    is therefore bounded by `max_in_flight` unfinished plus `max_retained`
+    finished flows.
+    """
+
+    def __init__(self, max_active=64, max_retained=1000, max_in_flight=256):
+        self.max_retained = max_retained
+        self.max_in_flight = max_in_flight
+        self._active = asyncio.Semaphore(max_active)
+        self._flows = OrderedDict()
+        self._tasks = {}
+
+    def get(self, flow_id):
+        return self._flows.get(flow_id)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_active=int(os.environ.get("LLM_FLOW_MAX_ACTIVE", 64)),
+            max_retained=int(os.environ.get("LLM_FLOW_MAX_RETAINED", 1000)),
+            max_in_flight=int(os.environ.get("LLM_FLOW_MAX_IN_FLIGHT", 256)),
+        )
+
+    def start(self, goal, call, agent_llms=None, llms=None, stages=DEFAULT_STAGES):
+        validate_stages(stages)
+        if len(self._tasks) >= self.max_in_flight:
+            raise FlowLimitExceeded(f"{len(self._tasks)} flows are already queued or running")
+        flow = Flow(goal, agent_llms or {}, llms or {}, stages)
+        self._flows[flow.id] = flow
+        self._prune()
+        task = self._tasks[flow.id] = asyncio.ensure_future(self._run(flow, call))
+        task.add_done_callback(lambda _: self._tasks.pop(flow.id, None))
+        return flow
+
+    async def wait(self, flow_id):
+        task = self._tasks.get(flow_id)
+        if task is not None:
+            await asyncio.shield(task)
+        return self._flows[flow_id]
+
+    def cancel(self, flow_id):
+        task = self._tasks.get(flow_id)
+        if task is not None:
+            task.cancel()
+
+    async def aclose(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _prune(self):
+        # Forget the oldest finished flows once over the retention bound
+        for flow_id in list(self._flows):
+            if len(self._flows) <= self.max_retained:
+                break
+            if self._flows[flow_id].done:
+                del self._flows[flow_id]
+
+    async def _run(self, flow, call):
+        async with self._active:
+            flow.status = "running"
+            flow.started = time.monotonic()
+            pending = {stage.name: stage for stage in flow.stages}
+            running = {}
+            try:
+                while pending or running:
+                    for name, stage in list(pending.items()):
+                        if all(dep in flow.outputs for dep in stage.depends_on):
+                            running[asyncio.ensure_future(self._run_stage(flow, stage, call))] = stage
+                            del pending[name]
+                    done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        stage = running.pop(task)
+                        flow.outputs[stage.name] = task.result()
+            except asyncio.CancelledError:
+                flow.error = "Flow cancelled"
+                flow._close("cancelled")
+                raise
+            except Exception as e:
+                flow.error = str(e)
+                flow.emit("error", self._message(flow, "System", "User", "error", str(e)))
+                flow._close("failed")
+            else:
+                flow._close("completed")
+            finally:
+                for task in running:
+                    task.cancel()
+
+    async def _run_stage(self, flow, stage, call):
+        provider = flow.agent_llms.get(stage.agent) or "openai"
+        config = flow.llms.get(provider) or {}
+        messages = stage.prompt(flow.outputs)
+        model = config.get("model") or ""
+        flow.emit("llm_request", self._message(flow, stage.agent, "LLM", "llm_request", "",
+                                                prompt=messages, provider=provider, model=model))
+        status, body = await call(provider, dict(config, messages=messages, agent=stage.agent, flowId=flow.id))
+        if status != 200:
+            raise RuntimeError(f"{stage.agent} {provider} call failed ({status}): {body.get('error', body)}")
+        content = body["content"]
+        usage = {
+            "prompt_tokens": body["usage"]["promptTokens"],
+            "completion_tokens": body["usage"]["completionTokens"],
+            "total_tokens": body["usage"]["totalTokens"],
+        }
+        flow.emit("llm_response", self._message(flow, stage.agent, "LLM", "llm_response", content,
+                                                 prompt=messages, provider=provider, model=model, usage=usage))
+        flow.emit(stage.event, self._message(flow, stage.agent, stage.receiver, "task", content, id=str(uuid.uuid4())))
+        return content
+
+    @staticmethod
+    def _message(flow, sender, receiver, kind, content, **extra):
+        # Same shape as the browser bus Message (frontend/src/context/AgentBusContext.tsx)
+        return {"sender": sender, "receiver": receiver, "type": kind, "content": content,
+                "timestamp": _now(), "flowId": flow.id, **extra}
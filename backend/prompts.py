@@ -0,0 +1,266 @@
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; counts fall back to ~4 characters per token
+    tiktoken = None
+
+# Anthropic ignores cache_control on prefixes shorter than this and allows four breakpoints
+MIN_CACHE_TOKENS = 1024
+MAX_BREAKPOINTS = 4
+
+# Paragraphs shorter than this are never deduplicated (headings, separators, "Thanks!")
+MIN_DEDUP_CHARS = 200
+
+# Never cut a message down below this many tokens when truncating
+MIN_KEEP_TOKENS = 64
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # the BPE file may need a download that isn't possible here
+        return None
+
+
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _text(content):
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content or [] if isinstance(block, dict))
+
+
+def message_tokens(message):
+    # Content plus a few tokens of per-message framing
+    return count_tokens(_text(message.get("content"))) + 4
+
+
+def _dedup(messages):
+    """Drop repeated messages and long paragraphs already present earlier in the history.
+
+    The latest message is the one being answered, so it is always sent whole.
+    """
+    seen_messages, seen_blocks = set(), set()
+    out, removed = [], 0
+    for i, message in enumerate(messages):
+        content = message.get("content")
+        if not isinstance(content, str) or i == len(messages) - 1:
+            out.append(message)
+            continue
+        key = (message.get("role"), content)
+        if key in seen_messages:
+            removed += 1
+            continue
+        seen_messages.add(key)
+        blocks = content.split("\n\n")
+        kept = []
+        for block in blocks:
+            stripped = block.strip()
+            if len(stripped) >= MIN_DEDUP_CHARS:
+                if stripped in seen_blocks:
+                    removed += 1
+                    continue
+                seen_blocks.add(stripped)
+            kept.append(block)
+        if not kept:
+            continue
+        out.append(message if len(kept) == len(blocks) else dict(message, content="\n\n".join(kept)))
+    return out, removed
+
+
+def _truncate(message, keep_tokens):
+    """Cut the middle out of a message so that, marker included, it costs at most `keep_tokens`."""
+    content = message["content"]
+    tokens = message_tokens(message)
+    marker = f"\n\n[... {tokens - keep_tokens} tokens truncated ...]\n\n"
+    keep_chars = int(len(content) * keep_tokens / tokens)
+    while True:
+        head, tail = content[:keep_chars // 2], content[len(content) - (keep_chars - keep_chars // 2):]
+        truncated = dict(message, content=head + marker + tail)
+        over = message_tokens(truncated) - keep_tokens
+        if over <= 0 or keep_chars == 0:
+            return truncated
+        keep_chars = max(keep_chars - int(over * len(content) / tokens) - 1, 0)
+
+
+def _fit(messages, budget):
+    """Drop the oldest turns, then cut the middle out of the largest message, until under budget.
+
+    System messages and the latest message are always kept.
+    """
+    tokens = [message_tokens(m) for m in messages]
+    total = sum(tokens)
+    dropped = set()
+    for i, message in enumerate(messages[:-1]):
+        if total <= budget:
+            break
+        if message.get("role") != "system":
+            dropped.add(i)
+            total -= tokens[i]
+    # A history can't start with an assistant turn once the user turn before it is gone
+    for i, message in enumerate(messages[:-1]):
+        if i in dropped or message.get("role") == "system":
+            continue
+        if message.get("role") == "assistant":
+            dropped.add(i)
+            total -= tokens[i]
+        break
+    kept = [m for i, m in enumerate(messages) if i not in dropped]
+    truncated = 0
+    if total > budget:
+        sizes = [message_tokens(m) if isinstance(m.get("content"), str) else 0 for m in kept]
+        largest = max(range(len(kept)), key=sizes.__getitem__)
+        keep_tokens = max(sizes[largest] - (total - budget), MIN_KEEP_TOKENS)
+        if keep_tokens < sizes[largest]:
+            kept[largest] = _truncate(kept[largest], keep_tokens)
+            truncated = 1
+    return kept, len(dropped), truncated
+
+
+def compact(messages, budget=None, dedup=True):
+    """Shrink a message history; returns (messages, report)."""
+    before = sum(message_tokens(m) for m in messages)
+    deduped = dropped = truncated = 0
+    if dedup:
+        messages, deduped = _dedup(messages)
+    if budget:
+        messages, dropped, truncated = _fit(messages, budget)
+    after = sum(message_tokens(m) for m in messages)
+    return messages, {
+        "promptTokensBefore": before,
+        "promptTokensAfter": after,
+        "tokensSaved": before - after,
+        "dedupedBlocks": deduped,
+        "droppedMessages": dropped,
+        "truncatedMessages": truncated,
+    }
+
+
+def compact_request(data):
+    """Apply a request body's optional "compact" setting.
+
+    `"compact": true` deduplicates repeated blocks (and truncates to
+    LLM_COMPACT_BUDGET when that is set); `"compact": {"budget": 6000,
+    "dedup": false}` picks the steps. Returns (data, report); report is None
+    when compaction is off.
+    """
+    options = data.get("compact")
+    if not options:
+        return data, None
+    if not isinstance(options, dict):
+        options = {}
+    budget = options.get("budget") or os.environ.get("LLM_COMPACT_BUDGET")
+    try:
+        budget = int(budget) if budget else None
+    except (TypeError, ValueError):
+        raise ValueError("compact.budget must be a number of tokens")
+    messages, report = compact(data.get("messages") or [], budget, options.get("dedup", True))
+    return dict(data, messages=messages), report
+
+
+def report_headers(report):
+    return {
+        "X-Prompt-Tokens-Before": str(report["promptTokensBefore"]),
+        "X-Prompt-Tokens-After": str(report["promptTokensAfter"]),
+        "X-Prompt-Tokens-Saved": str(report["tokensSaved"]),
+    }
+
+
+_CACHED_FIELDS = re.compile(rb'"(cache_read_input_tokens|cached_tokens)"\s*:\s*(\d+)')
+
+
+def cached_prompt_tokens(content):
+    """Prompt tokens the provider served from its prefix cache, read from a raw response body."""
+    start = content.rfind(b'"usage"')
+    if start < 0:
+        return 0
+    return sum(int(count) for _, count in _CACHED_FIELDS.findall(content, start))
+
+
+class PrefixTracker:
+    """Hashes of recently sent prompt prefixes, to spot the ones reused across calls."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._seen = OrderedDict()
+
+    def __contains__(self, digest):
+        return digest in self._seen
+
+    def add(self, digest):
+        self._seen[digest] = True
+        self._seen.move_to_end(digest)
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+
+
+def _with_breakpoint(content):
+    ephemeral = {"type": "ephemeral"}
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": ephemeral}]
+    blocks = list(content)
+    blocks[-1] = dict(blocks[-1], cache_control=ephemeral)
+    return blocks
+
+
+def add_cache_breakpoints(payload, tracker):
+    """Mark an Anthropic payload's stable prefixes with cache_control.
+
+    Breakpoints go on the system prompt, on the longest prefix that an
+    earlier call already sent, and, when such a prefix exists, on the end of
+    the prompt so the next turn of the conversation can read it back. Only
+    prefixes of at least MIN_CACHE_TOKENS qualify. Returns (payload,
+    breakpoints); the input payload is left untouched.
+    """
+    system = payload.get("system")
+    messages = payload.get("messages") or []
+    running = hashlib.sha256(str(payload.get("model")).encode())
+    tokens = 0
+    boundaries = []  # (message index, -1 for the system prompt; prefix digest; prefix tokens)
+    if system:
+        running.update(_text(system).encode())
+        tokens += count_tokens(_text(system))
+        boundaries.append((-1, running.hexdigest(), tokens))
+    for i, message in enumerate(messages):
+        running.update(b"\0" + str(message.get("role")).encode() + b"\0" + _text(message.get("content")).encode())
+        tokens += message_tokens(message)
+        boundaries.append((i, running.hexdigest(), tokens))
+
+    eligible = [b for b in boundaries if b[2] >= MIN_CACHE_TOKENS]
+    chosen = set()
+    if system and boundaries[0][2] >= MIN_CACHE_TOKENS:
+        chosen.add(-1)
+    reused = [b for b in eligible if b[1] in tracker]
+    if reused:
+        chosen.add(reused[-1][0])
+        chosen.add(eligible[-1][0])
+    for _, digest, _ in boundaries:
+        tracker.add(digest)
+    if not chosen:
+        return payload, 0
+
+    chosen = sorted(chosen)[-MAX_BREAKPOINTS:]
+    payload = dict(payload)
+    if -1 in chosen:
+        payload["system"] = _with_breakpoint(system)
+    marked = [i for i in chosen if i >= 0]
+    if marked:
+        messages = list(messages)
+        for i in marked:
+            if _text(messages[i].get("content")):
+                messages[i] = dict(messages[i], content=_with_breakpoint(messages[i]["content"]))
+        payload["messages"] = messages
+    return payload, len(chosen)
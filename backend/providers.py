@@ -0,0 +1,167 @@
+import os
+from typing import NamedTuple
+
+from prompts import PrefixTracker, add_cache_breakpoints
+
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(value):
+        return orjson.dumps(value)
+except ImportError:  # orjson is optional; the stdlib is just slower
+    import json
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":")).encode()
+
+
+class ProxyError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RawBody(NamedTuple):
+    """An upstream response body relayed as-is, with its original content type."""
+
+    content: bytes
+    media_type: str
+
+    def json(self):
+        return loads(self.content)
+
+
+def _usage(prompt, completion):
+    # Same shape as LLMResponse.usage in frontend/src/services/llm.ts
+    return {"promptTokens": prompt, "completionTokens": completion, "totalTokens": prompt + completion}
+
+
+class ProviderAdapter:
+    """Maps a proxy request body onto one provider's chat API.
+
+    `build` resolves credentials and model from the request body, then the
+    session, then the environment, and returns the upstream
+    (url, headers, payload). `wire_payload` applies provider-specific
+    request rewrites that must not affect cache or coalescing keys.
+    `normalize` turns the provider's response body into the unified
+    {content, model, usage} schema.
+    """
+
+    name = None
+    url = None
+    default_model = None
+    required_message = "API key is required"
+
+    def resolve(self, data, session, field, env=None):
+        return data.get(field) or session.get(f"{self.name}_{field}") or (os.environ.get(env) if env else None)
+
+    def endpoint(self, data, session):
+        # <PROVIDER>_API_URL points a provider at a compatible endpoint (e.g. a local mock)
+        return os.environ.get(f"{self.name.upper()}_API_URL") or self.url
+
+    def headers(self, api_key):
+        return {"Authorization": f"Bearer {api_key}"}
+
+    def payload(self, data, model):
+        return {
+            "model": model,
+            "messages": data.get("messages", []),
+            "max_tokens": data.get("max_tokens", 1000),
+            "temperature": data.get("temperature", 0.7),
+        }
+
+    def build(self, data, session):
+        api_key = self.resolve(data, session, "apiKey", f"{self.name.upper()}_API_KEY")
+        url = self.endpoint(data, session)
+        if not api_key or not url:
+            raise ProxyError(self.required_message)
+        model = self.resolve(data, session, "model") or self.default_model
+        return url, self.headers(api_key), self.payload(data, model)
+
+    def wire_payload(self, payload, data):
+        return payload
+
+    def normalize(self, body, model=None):
+        choice = (body.get("choices") or [{}])[0]
+        content = (choice.get("message") or {}).get("content") or choice.get("text") or ""
+        usage = body.get("usage") or {}
+        return {
+            "content": content,
+            "model": body.get("model") or model,
+            "usage": _usage(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)),
+        }
+
+
+class OpenAIAdapter(ProviderAdapter):
+    name = "openai"
+    url = "https://api.openai.com/v1/chat/completions"
+    default_model = "gpt-3.5-turbo"
+
+
+class AnthropicAdapter(ProviderAdapter):
+    name = "anthropic"
+    url = "https://api.anthropic.com/v1/messages"
+    default_model = "claude-3-opus-20240229"
+
+    def __init__(self):
+        self.prefixes = PrefixTracker()
+
+    def headers(self, api_key):
+        return {
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json"
+        }
+
+    def payload(self, data, model):
+        messages = data.get("messages", [])
+        payload = {
+            "model": model,
+            "max_tokens": data.get("max_tokens", 1000),
+            "temperature": data.get("temperature", 0.7),
+            "messages": [m for m in messages if m.get("role") != "system"],
+        }
+        # The Messages API takes system prompts as a top-level field, not as a role
+        system = [m["content"] for m in messages if m.get("role") == "system" and isinstance(m.get("content"), str)]
+        if any(system):
+            payload["system"] = "\n\n".join(filter(None, system))
+        return payload
+
+    def wire_payload(self, payload, data):
+        # Prompt caching is on unless the request or ANTHROPIC_PROMPT_CACHE=0 turns it off
+        if data.get("promptCache") is False or os.environ.get("ANTHROPIC_PROMPT_CACHE") == "0":
+            return payload
+        return add_cache_breakpoints(payload, self.prefixes)[0]
+
+    def normalize(self, body, model=None):
+        content = "".join(block.get("text", "") for block in body.get("content") or [])
+        usage = body.get("usage") or {}
+        return {
+            "content": content,
+            "model": body.get("model") or model,
+            "usage": _usage(usage.get("input_tokens", 0), usage.get("output_tokens", 0)),
+        }
+
+
+class DatabricksAdapter(ProviderAdapter):
+    name = "databricks"
+    default_model = "dbrx-instruct"
+    required_message = "API key and API URL are required"
+
+    def endpoint(self, data, session):
+        return self.resolve(data, session, "apiUrl", "DATABRICKS_API_URL")
+
+    def headers(self, api_key):
+        return {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+
+ADAPTERS = {adapter.name: adapter for adapter in (OpenAIAdapter(), AnthropicAdapter(), DatabricksAdapter())}
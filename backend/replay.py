@@ -0,0 +1,142 @@
+"""Replay journaled LLM calls through the proxy against the local mock provider.
+
+    python replay.py --journal journal --flow 6f1c...
+    python replay.py --journal journal --session 3b9a... --speed 4
+
+Reads the calls of one flow or session from the call journal (LLM_JOURNAL_DIR)
+and reissues them through a fresh app process whose providers all point at the
+mock, at their original offsets from the first call divided by --speed. Each
+call keeps its provider, model, messages and streaming mode, and asks for as
+many tokens as the original completion had. The response cache is bypassed.
+Per-call original and replayed latencies, the two makespans and their
+summaries are saved as JSON next to the load-test results, so
+`loadtest.py --compare` can diff two replays.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from journal import Journal
+from loadtest import HERE, git_commit, serve, summarize
+
+
+def load(directory, flow=None, session=None):
+    """All journaled calls of a flow or session, oldest first."""
+    journal = Journal(directory)
+    # The app may still be writing this journal; leave recovery to its owner
+    journal.open(recover=False)
+    records, cursor = [], None
+    try:
+        while True:
+            page, cursor = journal.query(session=session, flow_id=flow, before=cursor, limit=500)
+            records.extend(page)
+            if cursor is None:
+                break
+    finally:
+        journal.close()
+    return sorted(records, key=lambda record: record["ts"])
+
+
+def replay_body(record):
+    body = dict(record["request"], model=record["model"], stream=record["stream"], cache="bypass")
+    completion = (record.get("usage") or {}).get("completionTokens")
+    if completion:
+        # The mock answers with min(--tokens, max_tokens) tokens
+        body["max_tokens"] = completion
+    return body
+
+
+async def run(args, records):
+    # The replaying app must not journal into the journal being replayed
+    os.environ.pop("LLM_JOURNAL_DIR", None)
+    concurrency = min(len(records), 64)
+    first = records[0]["ts"]
+    async with serve(args, concurrency) as (app_base, _, _):
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+            started = time.perf_counter()
+
+            async def call(record):
+                delay = (record["ts"] - first) / args.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                url = f"{app_base}/api/llm/{record['provider']}"
+                sent = time.perf_counter()
+                ttfb = None
+                try:
+                    if record["stream"]:
+                        async with client.stream("POST", url, json=replay_body(record)) as resp:
+                            async for _ in resp.aiter_bytes():
+                                ttfb = ttfb or time.perf_counter() - sent
+                    else:
+                        resp = await client.post(url, json=replay_body(record))
+                    status = resp.status_code
+                except httpx.HTTPError:
+                    status = 599
+                finished = time.perf_counter()
+                return {
+                    "id": record["id"], "agent": record.get("agent"), "provider": record["provider"],
+                    "model": record["model"], "stream": record["stream"],
+                    "originalStatus": record["status"], "status": status,
+                    "originalMs": record["latencyMs"], "replayMs": round((finished - sent) * 1000, 1),
+                    "ttfbMs": round(ttfb * 1000, 1) if ttfb is not None else None,
+                    "finishedS": finished - started,
+                }
+
+            calls = await asyncio.gather(*(call(record) for record in records))
+
+    original_span = max(r["ts"] + r["latencyMs"] / 1000 for r in records) - first
+    replay_span = max(c.pop("finishedS") for c in calls)
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "flow": args.flow, "session": args.session, "calls": len(records), "speed": args.speed,
+            "latency": args.latency, "tokenRate": args.token_rate, "tokens": args.tokens,
+        },
+        "original": summarize([c["originalMs"] / 1000 for c in calls], [],
+                              [c["originalStatus"] for c in calls], original_span),
+        "replay": summarize([c["replayMs"] / 1000 for c in calls],
+                            [c["ttfbMs"] / 1000 for c in calls if c["ttfbMs"] is not None],
+                            [c["status"] for c in calls], replay_span),
+        "makespan": {"originalS": round(original_span, 3), "replayS": round(replay_span, 3)},
+        "calls": calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--journal", default=os.environ.get("LLM_JOURNAL_DIR"), help="journal directory")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--flow", help="flow id")
+    target.add_argument("--session", help="journal session key (the `session` field of a record)")
+    parser.add_argument("--speed", type=float, default=1.0, help="divide the original gaps between calls by this")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock time to first byte (s)")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="mock tokens/s; 0 = instant")
+    parser.add_argument("--tokens", type=int, default=4096, help="mock completion length cap")
+    parser.add_argument("--output", help="results file (default loadtest-results/replay-<time>-<commit>.json)")
+    args = parser.parse_args()
+    # serve() passes these through to the mock
+    args.error_rate, args.error_status = 0.0, 500
+    if not args.journal:
+        parser.error("--journal (or LLM_JOURNAL_DIR) is required")
+    records = load(args.journal, args.flow, args.session)
+    if not records:
+        parser.error("no journaled calls match")
+    result = asyncio.run(run(args, records))
+    output = args.output or os.path.join(
+        HERE, "loadtest-results", f"replay-{datetime.now():%Y%m%d-%H%M%S}-{result['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps({key: value for key, value in result.items() if key != "calls"}, indent=2))
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+import asyncio
+import hashlib
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class LimitExceeded(Exception):
+    """A caller could not get through a rate or concurrency limit before its deadline."""
+
+    status_code = 429
+
+
+class CircuitOpen(Exception):
+    status_code = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _env(provider, name, default, cast):
+    for key in (f"{provider.upper()}_{name}", f"LLM_{name}"):
+        value = os.environ.get(key)
+        if value not in (None, ""):
+            return cast(value)
+    return default
+
+
+@dataclass
+class ResilienceConfig:
+    requests_per_second: float = 0.0  # 0 disables the request bucket
+    request_burst: float = 10.0
+    tokens_per_minute: float = 0.0  # 0 disables the token bucket
+    min_concurrency: int = 1
+    initial_concurrency: int = 16
+    max_concurrency: int = 64
+    latency_spike_factor: float = 3.0
+    max_retries: int = 2
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    breaker_failures: int = 5
+    breaker_cooldown: float = 30.0
+    queue_timeout: float = 30.0
+
+    @classmethod
+    def from_env(cls, provider):
+        return cls(
+            requests_per_second=_env(provider, "RPS", cls.requests_per_second, float),
+            request_burst=_env(provider, "RPS_BURST", cls.request_burst, float),
+            tokens_per_minute=_env(provider, "TPM", cls.tokens_per_minute, float),
+            initial_concurrency=_env(provider, "INITIAL_CONCURRENCY", cls.initial_concurrency, int),
+            max_concurrency=_env(provider, "MAX_CONCURRENCY", cls.max_concurrency, int),
+            max_retries=_env(provider, "MAX_RETRIES", cls.max_retries, int),
+            breaker_failures=_env(provider, "BREAKER_FAILURES", cls.breaker_failures, int),
+            breaker_cooldown=_env(provider, "BREAKER_COOLDOWN", cls.breaker_cooldown, float),
+            queue_timeout=_env(provider, "QUEUE_TIMEOUT", cls.queue_timeout, float),
+        )
+
+
+class TokenBucket:
+    """Token bucket whose waiters are served first-come, first-served."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount, deadline):
+        amount = min(amount, self.capacity)
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, which keeps the queue fair
+            await asyncio.wait_for(self._lock.acquire(), max(deadline - self.clock(), 0))
+        except asyncio.TimeoutError:
+            raise LimitExceeded("Timed out waiting for the rate limiter")
+        try:
+            self._refill()
+            if self.tokens < amount:
+                wait = (amount - self.tokens) / self.rate
+                if self.clock() + wait > deadline:
+                    raise LimitExceeded("Rate limit wait would exceed the request deadline")
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= amount
+        finally:
+            self._lock.release()
+
+    def drain(self, seconds):
+        # Upstream said to back off: pretend the bucket was just emptied
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class AdaptiveLimit:
+    """AIMD concurrency limit.
+
+    Grows by roughly one slot per window of successful calls and halves on
+    429s or latency spikes (a sample well above the moving average). Callers
+    over the limit queue in FIFO order until a slot frees up or their
+    deadline passes.
+    """
+
+    def __init__(self, initial=16, minimum=1, maximum=64, spike_factor=3.0, clock=time.monotonic):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.spike_factor = spike_factor
+        self.clock = clock
+        self.in_flight = 0
+        self.latency = None
+        self._last_decrease = 0.0
+        self._waiters = deque()
+
+    async def acquire(self, deadline):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, max(deadline - self.clock(), 0))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # A slot was handed over as we gave up; pass it on
+                self._release_slot()
+            elif fut in self._waiters:
+                self._waiters.remove(fut)
+            if isinstance(e, asyncio.TimeoutError):
+                raise LimitExceeded("Timed out waiting for a concurrency slot")
+            raise
+
+    def release(self, latency=None, overloaded=False):
+        if overloaded:
+            self._decrease()
+        elif latency is not None:
+            if self.latency is not None and latency > self.latency * self.spike_factor:
+                self._decrease()
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+        self._release_slot()
+
+    def _decrease(self):
+        # At most one halving per average round-trip, so a burst of 429s from
+        # one overload counts once
+        now = self.clock()
+        if now - self._last_decrease >= (self.latency or 0):
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(None)
+
+
+class CircuitBreaker:
+    """Opens after N consecutive failures, then lets one probe through per cooldown."""
+
+    def __init__(self, failures=5, cooldown=30.0, clock=time.monotonic):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def check(self, name):
+        state = self.state
+        if state == "open" or (state == "half-open" and self._probing):
+            retry_after = max(self.cooldown - (self.clock() - self.opened_at), 1.0)
+            raise CircuitOpen(f"{name} is failing; circuit open", retry_after)
+        if state == "half-open":
+            self._probing = True
+
+    def abandon(self):
+        # The admitted call never reached the provider
+        self._probing = False
+
+    def record(self, ok):
+        self._probing = False
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.failures >= self.threshold or self.opened_at is not None:
+            self.opened_at = self.clock()
+
+
+def retry_after(resp):
+    """Seconds to wait according to a Retry-After header, if any."""
+    value = resp.headers.get("retry-after") if resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(payload):
+    # Rough pre-flight cost for the token bucket: ~4 characters per token for
+    # the prompt plus the completion budget
+    chars = sum(len(str(m.get("content", ""))) for m in payload.get("messages") or [])
+    return chars // 4 + int(payload.get("max_tokens") or 0)
+
+
+class ProviderGuard:
+    """Rate limits, adaptive concurrency, retries and a circuit breaker for one provider key."""
+
+    def __init__(self, name, config, clock=time.monotonic):
+        self.name = name
+        self.config = config
+        self.clock = clock
+        self.requests = TokenBucket(config.requests_per_second, config.request_burst, clock) \
+            if config.requests_per_second > 0 else None
+        self.tokens = TokenBucket(config.tokens_per_minute / 60.0, config.tokens_per_minute, clock) \
+            if config.tokens_per_minute > 0 else None
+        self.concurrency = AdaptiveLimit(config.initial_concurrency, config.min_concurrency,
+                                         config.max_concurrency, config.latency_spike_factor, clock)
+        self.breaker = CircuitBreaker(config.breaker_failures, config.breaker_cooldown, clock)
+        self.retries = 0
+
+    def backoff(self, attempt, resp):
+        hinted = retry_after(resp)
+        if hinted is not None:
+            return hinted
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.config.backoff_max, self.config.backoff_base * 2 ** attempt))
+
+    async def send(self, send, tokens=0, timeout=None, hold=False):
+        """Run `send()` (returning an httpx.Response) under this guard.
+
+        Retryable responses are closed and retried; the final response is
+        returned as-is for the caller to interpret. With `hold=True` (streams,
+        whose body is still being read after `send()` returns) the concurrency
+        slot stays taken and `(response, release)` is returned; the caller
+        must call `release()` once the response is closed.
+        """
+        deadline = self.clock() + (timeout if timeout is not None else self.config.queue_timeout)
+        attempt = 0
+        while True:
+            self.breaker.check(self.name)
+            try:
+                if self.requests is not None:
+                    await self.requests.acquire(1, deadline)
+                if self.tokens is not None and tokens:
+                    await self.tokens.acquire(tokens, deadline)
+                await self.concurrency.acquire(deadline)
+            except BaseException:
+                self.breaker.abandon()
+                raise
+            started = self.clock()
+            resp = error = None
+            try:
+                resp = await send()
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                self.breaker.abandon()
+                raise
+            finally:
+                overloaded = resp is not None and resp.status_code == 429
+                # The AIMD latency signal is time to response headers, held or not
+                latency = None if resp is None else self.clock() - started
+                release = self._releaser(latency, overloaded)
+                if not hold or resp is None:
+                    release()
+            failed = error is not None or resp.status_code >= 500
+            self.breaker.record(not failed)
+            retryable = error is not None or resp.status_code in RETRYABLE_STATUS
+            if not retryable or attempt >= self.config.max_retries:
+                if error is not None:
+                    raise error
+                return (resp, release) if hold else resp
+            delay = self.backoff(attempt, resp)
+            if overloaded:
+                for bucket in (self.requests, self.tokens):
+                    if bucket is not None:
+                        bucket.drain(delay)
+            if self.clock() + delay > deadline:
+                if error is not None:
+                    raise error
+                return (resp, release) if hold else resp
+            if resp is not None:
+                release()
+                await resp.aclose()
+            self.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _releaser(self, latency, overloaded):
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.concurrency.release(latency, overloaded)
+        return release
+
+    @property
+    def idle(self):
+        return self.concurrency.in_flight == 0 and not self.concurrency._waiters
+
+    def stats(self):
+        return {
+            "concurrencyLimit": round(self.concurrency.limit, 2),
+            "inFlight": self.concurrency.in_flight,
+            "queued": len(self.concurrency._waiters),
+            "circuit": self.breaker.state,
+            "retries": self.retries,
+        }
+
+
+class Resilience:
+    """ProviderGuards keyed by provider and a hash of the caller's credentials.
+
+    At most `max_guards` are kept: past that, the least recently used guards
+    with nothing in flight or queued are dropped, so callers cycling through
+    made-up keys can't grow the table without bound.
+    """
+
+    def __init__(self, configs=None, max_guards=None):
+        self.configs = configs or {}
+        self.max_guards = max_guards or int(os.environ.get("LLM_MAX_GUARDS", 1024))
+        self._guards = OrderedDict()
+
+    def guard(self, provider, headers):
+        credential = headers.get("Authorization") or headers.get("x-api-key") or ""
+        key = (provider, hashlib.sha256(credential.encode()).hexdigest()[:12])
+        guard = self._guards.get(key)
+        if guard is None:
+            config = self.configs.get(provider) or ResilienceConfig.from_env(provider)
+            guard = self._guards[key] = ProviderGuard(provider, config)
+            self._evict()
+        else:
+            self._guards.move_to_end(key)
+        return guard
+
+    def _evict(self):
+        excess = len(self._guards) - self.max_guards
+        for key in list(self._guards):
+            if excess <= 0:
+                break
+            if self._guards[key].idle:
+                del self._guards[key]
+                excess -= 1
+
+    def stats(self):
+        return {f"{provider}:{key}": guard.stats() for (provider, key), guard in self._guards.items()}
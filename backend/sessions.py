@@ -0,0 +1,283 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import cookie_parser
+
+from providers import dumps, loads
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.sqlite")
+
+
+class MemoryStore:
+    """Sessions held by this process only: fine for one worker and for tests."""
+
+    def __init__(self):
+        self._rows = OrderedDict()
+
+    def load(self, sid):
+        return self._rows.get(sid)
+
+    def save(self, sid, data, expires, now):
+        self._rows[sid] = (data, expires)
+        self._rows.move_to_end(sid)
+        # Rows are kept in save order, which is expiry order for a fixed TTL,
+        # so expired sessions are always at the front
+        while self._rows:
+            oldest = next(iter(self._rows.values()))
+            if oldest[1] > now:
+                break
+            self._rows.popitem(last=False)
+
+    def delete(self, sid):
+        self._rows.pop(sid, None)
+
+    def changed(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class SQLiteStore:
+    """Sessions in a SQLite file that every uvicorn worker on the host opens.
+
+    Calls are synchronous and run on the event loop. Writes only happen when a
+    session is created, changed or renewed, and reads mostly hit the
+    SessionManager's cache.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+        self._version = self._data_version()
+
+    def _data_version(self):
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self, sid):
+        with self._lock:
+            row = self._db.execute("SELECT data, expires FROM sessions WHERE id = ?", (sid,)).fetchone()
+        return (loads(row[0]), row[1]) if row else None
+
+    def save(self, sid, data, expires, now):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)", (sid, dumps(data), expires)
+            )
+            self._db.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def delete(self, sid):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def changed(self):
+        # data_version moves only when another connection (another worker) commits
+        with self._lock:
+            version = self._data_version()
+            changed, self._version = version != self._version, version
+        return changed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SessionManager:
+    """Opaque session ids mapped to small dicts, with an LRU in front of the store.
+
+    Cached entries stay valid until another worker writes to the shared store.
+    Checking for such writes is a query of its own, so it happens at most
+    once every `sync_interval` seconds. A request that reads credentials then
+    costs one dict lookup in the common case, at the price of seeing another
+    worker's changes up to `sync_interval` late. Sessions expire `ttl`
+    seconds after their last write and are renewed once they are past half
+    their lifetime.
+    """
+
+    def __init__(self, store=None, ttl=14 * 24 * 3600.0, cache_size=1024, clock=time.time, sync_interval=0.0):
+        self.store = store or MemoryStore()
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.clock = clock
+        self.sync_interval = sync_interval
+        self._synced = None
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.loads = 0
+
+    @classmethod
+    def from_env(cls):
+        # An empty SESSION_STORE_PATH keeps sessions in process memory
+        path = os.environ.get("SESSION_STORE_PATH", DEFAULT_STORE_PATH)
+        return cls(
+            store=SQLiteStore(path) if path else MemoryStore(),
+            ttl=float(os.environ.get("SESSION_TTL", 14 * 24 * 3600)),
+            cache_size=int(os.environ.get("SESSION_CACHE_SIZE", 1024)),
+            sync_interval=float(os.environ.get("SESSION_SYNC_INTERVAL", 1.0)),
+        )
+
+    def new_id(self):
+        return secrets.token_urlsafe(32)
+
+    def get(self, sid):
+        """(data, expires) for a live session, or None. `data` must not be mutated."""
+        self._sync()
+        entry = self._cache.get(sid)
+        if entry is None:
+            entry = self.store.load(sid)
+            self.loads += 1
+            if entry is None:
+                return None
+            self._remember(sid, entry)
+        else:
+            self._cache.move_to_end(sid)
+            self.hits += 1
+        if entry[1] <= self.clock():
+            self.delete(sid)
+            return None
+        return entry
+
+    def _sync(self):
+        now = self.clock()
+        if self._synced is not None and now - self._synced < self.sync_interval:
+            return
+        self._synced = now
+        if self.store.changed():
+            self._cache.clear()
+
+    def save(self, sid, data):
+        now = self.clock()
+        entry = (data, now + self.ttl)
+        self.store.save(sid, data, entry[1], now)
+        self._remember(sid, entry)
+        return entry
+
+    def delete(self, sid):
+        self._cache.pop(sid, None)
+        self.store.delete(sid)
+
+    def needs_renewal(self, expires):
+        return expires - self.clock() < self.ttl / 2
+
+    def _remember(self, sid, entry):
+        self._cache[sid] = entry
+        self._cache.move_to_end(sid)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def close(self):
+        self.store.close()
+
+
+class LazySession(MutableMapping):
+    """`request.session`: loaded from the manager on first access, copied on first write."""
+
+    def __init__(self, manager, sid):
+        self._manager = manager
+        self.sid = sid
+        self._data = None
+        self.expires = None
+        self.modified = False
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    @property
+    def live(self):
+        """True when the cookie names an existing, unexpired session."""
+        self._load()
+        return self.expires is not None
+
+    def _load(self):
+        if self._data is None:
+            entry = self._manager.get(self.sid) if self.sid else None
+            self._data, self.expires = entry or ({}, None)
+        return self._data
+
+    def _writable(self):
+        data = self._load()
+        if not self.modified:
+            # Cached dicts are shared between requests; write to a private copy
+            self._data = data = dict(data)
+            self.modified = True
+        return data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __setitem__(self, key, value):
+        self._writable()[key] = value
+
+    def __delitem__(self, key):
+        del self._writable()[key]
+
+
+class ServerSessionMiddleware:
+    """Puts a LazySession in scope["session"] and persists it through app.state.sessions.
+
+    The cookie only carries the opaque session id; credentials stay on the
+    server. Requests that never touch request.session never reach the store.
+    """
+
+    def __init__(self, app, cookie_name="session_id", https_only=False, same_site="lax"):
+        self.app = app
+        self.cookie_name = cookie_name
+        self.flags = f"; path=/; HttpOnly; SameSite={same_site}" + ("; Secure" if https_only else "")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        manager = scope["app"].state.sessions
+        session = LazySession(manager, self._session_id(scope))
+        scope["session"] = session
+        if scope["type"] == "websocket":
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                cookie = self._commit(manager, session)
+                if cookie:
+                    MutableHeaders(scope=message).append("Set-Cookie", cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+    def _session_id(self, scope):
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                return cookie_parser(value.decode("latin-1")).get(self.cookie_name)
+        return None
+
+    def _commit(self, manager, session):
+        if session.modified:
+            if not session._data:
+                if session.sid:
+                    manager.delete(session.sid)
+                    return f"{self.cookie_name}=null; Max-Age=0{self.flags}"
+                return None
+            # Only reuse ids of live sessions; never adopt an unknown id a client made up
+            sid = session.sid if session.expires else manager.new_id()
+            manager.save(sid, session._data)
+        elif session.loaded and session.expires and manager.needs_renewal(session.expires):
+            sid = session.sid
+            manager.save(sid, session._data)
+        else:
+            return None
+        return f"{self.cookie_name}={sid}; Max-Age={int(manager.ttl)}{self.flags}"
@@ -0,0 +1,132 @@
+import json
+
+from starlette.responses import StreamingResponse
+
+# Normalized SSE stream sent to the browser, identical for every provider:
+#
+#   event: delta   data: {"content": "..."}
+#   event: usage   data: {"model": ..., "promptTokens": ..., "completionTokens": ..., "totalTokens": ...}
+#   event: error   data: {"error": "..."}
+#   event: done    data: {}
+#
+# `usage` is always sent once, right before `done`, with whatever the
+# provider reported (zeros when it reported nothing).
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def stream_payload(provider, payload):
+    payload = dict(payload, stream=True)
+    if provider == "openai":
+        # OpenAI only reports usage for streams when asked to
+        payload["stream_options"] = {"include_usage": True}
+    return payload
+
+
+async def _sse_data(resp):
+    # Yield (event, data) pairs from an upstream SSE body
+    event = None
+    async for line in resp.aiter_lines():
+        if not line:
+            event = None
+            continue
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            yield event, line[5:].strip()
+
+
+def _openai_events(usage):
+    # OpenAI and Databricks both speak the chat.completion.chunk format
+    def handle(event, data):
+        if data == "[DONE]":
+            return None
+        chunk = json.loads(data)
+        usage["model"] = chunk.get("model") or usage["model"]
+        if chunk.get("usage"):
+            usage["promptTokens"] = chunk["usage"].get("prompt_tokens", 0)
+            usage["completionTokens"] = chunk["usage"].get("completion_tokens", 0)
+        for choice in chunk.get("choices") or []:
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                return content
+        return None
+    return handle
+
+
+def _anthropic_events(usage):
+    def handle(event, data):
+        message = json.loads(data)
+        kind = message.get("type", event)
+        if kind == "message_start":
+            start = message.get("message", {})
+            usage["model"] = start.get("model") or usage["model"]
+            usage["promptTokens"] = start.get("usage", {}).get("input_tokens", 0)
+        elif kind == "content_block_delta":
+            return message.get("delta", {}).get("text") or None
+        elif kind == "message_delta":
+            usage["completionTokens"] = message.get("usage", {}).get("output_tokens", 0)
+        elif kind == "error":
+            raise RuntimeError(message.get("error", {}).get("message", data))
+        return None
+    return handle
+
+
+PARSERS = {
+    "openai": _openai_events,
+    "anthropic": _anthropic_events,
+    "databricks": _openai_events,
+}
+
+
+async def relay(provider, resp, model, observer=None):
+    """Translate an open upstream streaming response into normalized SSE bytes.
+
+    The upstream response is closed when the generator finishes or is closed
+    early, which is what happens when the browser disconnects. `observer`
+    (a metrics.StreamObserver) sees each delta's size and the final usage.
+    """
+    usage = {"model": model, "promptTokens": 0, "completionTokens": 0}
+    handle = PARSERS[provider](usage)
+    error = None
+    try:
+        async for event, data in _sse_data(resp):
+            content = handle(event, data)
+            if content:
+                chunk = sse("delta", {"content": content})
+                if observer is not None:
+                    observer.chunk(len(chunk))
+                yield chunk
+    except Exception as e:
+        error = e
+        yield sse("error", {"error": str(e)})
+    finally:
+        await resp.aclose()
+        if observer is not None:
+            observer.finish(usage, error)
+    usage["totalTokens"] = usage["promptTokens"] + usage["completionTokens"]
+    yield sse("usage", usage)
+    yield sse("done", {})
+
+
+class RelayResponse(StreamingResponse):
+    """StreamingResponse that always closes its relay, even on client disconnect.
+
+    Starlette stops iterating when the browser goes away but leaves the
+    generator suspended; closing it here releases the upstream connection
+    (and cancels the provider-side generation) right away.
+    """
+
+    def __init__(self, content, **kwargs):
+        kwargs.setdefault("media_type", "text/event-stream")
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        headers.update(kwargs.pop("headers", None) or {})
+        super().__init__(content, headers=headers, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
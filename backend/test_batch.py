@@ -0,0 +1,122 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from batch import BatchRunner
+
+# Simulated upstream latency per provider host
+DELAYS = {"api.openai.com": 0.05, "api.anthropic.com": 0.3, "fake-databricks.com": 0.1}
+
+
+class Upstream:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.calls = 0
+
+    async def __call__(self, request):
+        self.calls += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(DELAYS[request.url.host])
+        finally:
+            self.active -= 1
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        return httpx.Response(200, json={"echo": prompt})
+
+
+@pytest.fixture
+def upstream(mock_app):
+    handler = Upstream()
+    mock_app(handler, batch=BatchRunner(concurrency={"openai": 2, "anthropic": 8, "databricks": 8}))
+    return handler
+
+
+def item(provider, prompt, **extra):
+    body = {"provider": provider, "apiKey": "k", "messages": [{"role": "user", "content": prompt}], **extra}
+    if provider == "databricks":
+        body["apiUrl"] = "https://fake-databricks.com/invocations"
+    return body
+
+
+def run_batch(c, requests, **extra):
+    response = c.post("/api/llm/batch", json={"requests": requests, **extra})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_batch_runs_concurrently_and_streams_in_completion_order(upstream):
+    requests = [item("anthropic", "slow"), item("openai", "fast"), item("databricks", "medium")]
+    with TestClient(app) as c:
+        started = time.monotonic()
+        lines = run_batch(c, requests)
+        elapsed = time.monotonic() - started
+    assert [line["index"] for line in lines] == [1, 2, 0]
+    assert all(line["status"] == 200 for line in lines)
+    assert {line["index"]: line["body"]["echo"] for line in lines} == {0: "slow", 1: "fast", 2: "medium"}
+    # Time of the slowest call, not the sum of all three
+    assert elapsed < 0.45
+
+
+def test_batch_respects_per_provider_concurrency(upstream):
+    with TestClient(app) as c:
+        lines = run_batch(c, [item("openai", f"topic {i}") for i in range(6)])
+    assert len(lines) == 6
+    assert upstream.calls == 6
+    assert upstream.peak == 2
+
+
+def test_batch_deadline_cancels_stragglers(upstream):
+    with TestClient(app) as c:
+        lines = run_batch(c, [item("anthropic", "slow"), item("openai", "fast")], timeout=0.15)
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[1]["status"] == 200
+    assert by_index[0]["status"] == 504
+    assert by_index[0]["provider"] == "anthropic"
+
+
+def test_batch_reports_per_item_errors(upstream):
+    requests = [item("openai", "ok"), {"provider": "mystery"}, {"provider": "databricks", "apiKey": "k"}]
+    with TestClient(app) as c:
+        lines = run_batch(c, requests)
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[0]["status"] == 200
+    assert by_index[1] == {"index": 1, "provider": "mystery", "status": 400, "body": {"error": "Invalid provider"}}
+    assert by_index[2]["body"] == {"error": "API key and API URL are required"}
+
+
+def test_batch_validates_request(upstream):
+    with TestClient(app) as c:
+        assert c.post("/api/llm/batch", json={"requests": []}).status_code == 400
+        assert c.post("/api/llm/batch", json={"requests": [item("openai", "x")] * 65}).status_code == 400
+        assert c.post("/api/llm/batch", json={"requests": [item("openai", "x")], "timeout": "soon"}).status_code == 400
+
+
+def test_batch_keeps_pretty_printed_bodies_on_one_line(mock_app):
+    def handler(request):
+        body = {"choices": [{"message": {"content": "line one\nline two"}}]}
+        return httpx.Response(200, content=json.dumps(body, indent=2), headers={"content-type": "application/json"})
+
+    mock_app(handler, batch=BatchRunner())
+    with TestClient(app) as c:
+        lines = run_batch(c, [item("openai", "a"), item("databricks", "b")])
+    assert len(lines) == 2
+    assert all(line["body"]["choices"][0]["message"]["content"] == "line one\nline two" for line in lines)
+
+
+def test_batch_lines_carry_the_compaction_report(upstream):
+    requests = [item("openai", "plain"), item("openai", "latest " * 1000, compact={"budget": 200})]
+    with TestClient(app) as c:
+        lines = run_batch(c, requests)
+    by_index = {line["index"]: line for line in lines}
+    assert "compaction" not in by_index[0]
+    report = by_index[1]["compaction"]
+    assert report["truncatedMessages"] == 1 and report["promptTokensAfter"] <= 200
+    assert report["tokensSaved"] == report["promptTokensBefore"] - report["promptTokensAfter"] > 0
@@ -0,0 +1,185 @@
+import asyncio
+import sqlite3
+import threading
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from cache import ResponseCache, cache_key, cache_mode
+from providers import RawBody
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def upstream(mock_app):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"choices": [{"message": {"content": f"reply {len(calls)}"}}]})
+
+    mock_app(handler)
+    return calls
+
+
+def ask(c, **fields):
+    body = {"apiKey": "k", "messages": [{"role": "user", "content": "plan"}], **fields}
+    return c.post("/api/llm/openai", json=body)
+
+
+def test_cache_key_is_canonical():
+    a = cache_key("openai", "u", {"model": "m", "messages": [], "temperature": 0})
+    b = cache_key("openai", "u", {"temperature": 0, "messages": [], "model": "m"})
+    assert a == b
+    assert a != cache_key("anthropic", "u", {"model": "m", "messages": [], "temperature": 0})
+
+
+def test_cache_mode():
+    assert cache_mode({}, {"temperature": 0}) == (True, True)
+    assert cache_mode({}, {"temperature": 0.7}) == (False, False)
+    assert cache_mode({"cache": "use"}, {"temperature": 0.7}) == (True, True)
+    assert cache_mode({"cache": "refresh"}, {"temperature": 0}) == (False, True)
+    assert cache_mode({"cache": "bypass"}, {"temperature": 0}) == (False, False)
+    assert cache_mode({"stream": True}, {"temperature": 0}) == (False, False)
+    with pytest.raises(ValueError):
+        cache_mode({"cache": "sometimes"}, {})
+
+
+def test_lru_eviction_and_ttl():
+    clock = Clock()
+    cache = ResponseCache(max_entries=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    clock.now += 11
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["expirations"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path=path)
+    cache.set("k", RawBody(b'{"content": "persisted"}', "application/json"))
+    cache.close()
+    reopened = ResponseCache(path=path)
+    assert reopened.get("k") == RawBody(b'{"content": "persisted"}', "application/json")
+    reopened.close()
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    clock = Clock()
+    cache = ResponseCache(max_entries=1, path=str(tmp_path / "cache.sqlite"), disk_max_entries=2, clock=clock)
+    for key in "abc":
+        clock.now += 1
+        cache.set(key, RawBody(key.encode(), "text/plain"))
+    assert cache.get("a") is None
+    assert cache.get("b") == RawBody(b"b", "text/plain")
+    cache.close()
+
+
+@pytest.mark.anyio
+async def test_disk_writes_leave_the_event_loop(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path=path, disk_max_entries=20)
+    threads = []
+    write = cache.disk.set
+    cache.disk.set = lambda *args: (threads.append(threading.get_ident()), write(*args))
+    for i in range(45):
+        cache.set(str(i), RawBody(b"x", "text/plain"))
+    cache.close()
+    assert len(threads) == 45 and threading.get_ident() not in threads
+    reopened = ResponseCache(path=path)
+    rows = reopened.disk._db.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0]
+    # Pruned every other write, so at most one entry over the bound
+    assert 20 <= rows <= 21
+    assert reopened.get("44") == RawBody(b"x", "text/plain")
+    reopened.close()
+
+
+@pytest.mark.anyio
+async def test_disk_reads_leave_the_event_loop_and_skip_the_writer_lock(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    stored = ResponseCache(path=path)
+    stored.set("k", RawBody(b"x", "text/plain"))
+    stored.close()
+    cache = ResponseCache(path=path)
+    threads = []
+    read = cache.disk.get
+    cache.disk.get = lambda *args: (threads.append(threading.get_ident()), read(*args))[1]
+    # As if the writer thread were in the middle of a prune
+    with cache.disk._lock:
+        assert await asyncio.wait_for(cache.aget("k"), 1) == RawBody(b"x", "text/plain")
+    assert threads and threading.get_ident() not in threads
+    assert await cache.aget("k") == RawBody(b"x", "text/plain")
+    assert len(threads) == 1
+    cache.close()
+
+
+@pytest.mark.anyio
+async def test_failed_disk_writes_are_counted(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite"))
+
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    cache.disk.set = fail
+    cache.set("k", RawBody(b"x", "text/plain"))
+    cache.close()
+    assert cache.stats()["diskWriteErrors"] == 1
+
+
+def test_deterministic_calls_are_cached(upstream):
+    with TestClient(app) as c:
+        first = ask(c, temperature=0)
+        second = ask(c, temperature=0)
+        stats = c.get("/api/cache/stats").json()
+    assert first.headers["x-cache"] == "MISS"
+    assert second.headers["x-cache"] == "HIT"
+    assert first.json() == second.json()
+    assert len(upstream) == 1
+    assert stats["hits"] == 1 and stats["writes"] == 1
+
+
+def test_cached_responses_are_scoped_to_the_credential(upstream):
+    with TestClient(app) as c:
+        ask(c, temperature=0)
+        other = ask(c, temperature=0, apiKey="totally-wrong")
+        again = ask(c, temperature=0)
+    assert other.headers["x-cache"] == "MISS"
+    assert again.headers["x-cache"] == "HIT"
+    assert upstream[1].headers["Authorization"] == "Bearer totally-wrong"
+
+
+def test_sampled_calls_skip_cache_unless_opted_in(upstream):
+    with TestClient(app) as c:
+        assert ask(c).headers["x-cache"] == "BYPASS"
+        assert ask(c).json() != ask(c).json()
+        ask(c, cache="use")
+        assert ask(c, cache="use").headers["x-cache"] == "HIT"
+    assert len(upstream) == 4
+
+
+def test_bypass_and_refresh(upstream):
+    with TestClient(app) as c:
+        ask(c, temperature=0)
+        assert ask(c, temperature=0, cache="bypass").headers["x-cache"] == "BYPASS"
+        refreshed = ask(c, temperature=0, cache="refresh").json()
+        assert ask(c, temperature=0).json() == refreshed
+        assert ask(c, cache="bogus").status_code == 400
+    assert len(upstream) == 3
@@ -0,0 +1,210 @@
+import asyncio
+import os
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from journal import Journal
+from providers import RawBody
+from replay import load, replay_body
+from sessions import SessionManager
+
+BODY = RawBody(b'{"choices": [{"message": {"content": "ok"}}], '
+               b'"usage": {"prompt_tokens": 7, "completion_tokens": 3}}', "application/json")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def call(journal, owner="s1", agent="PlannerAgent", flow="f1", ts=1000.0, status=200):
+    data = {"apiKey": "sk-secret", "model": "gpt-4o", "agent": agent, "flowId": flow,
+            "messages": [{"role": "user", "content": "hi"}]}
+    journal.record("openai", data, {}, owner, ts, 0.25, status,
+                   BODY if status == 200 else {"error": "boom"}, "MISS" if status == 200 else None)
+
+
+@pytest.fixture
+def journaled(mock_app, tmp_path):
+    def handler(request):
+        return httpx.Response(200, content=BODY.content, headers={"content-type": "application/json"})
+
+    return mock_app(handler, sessions=SessionManager(), journal=Journal(str(tmp_path / "journal"))).journal
+
+
+@pytest.mark.anyio
+async def test_records_are_written_in_batches(tmp_path):
+    journal = Journal(str(tmp_path))
+    await journal.start()
+    for i in range(20):
+        call(journal, ts=1000.0 + i)
+    call(journal, status=502, ts=1020.0)
+    await journal.aclose()
+    assert journal.written == 21
+    journal.open()
+    records, cursor = journal.query(limit=50)
+    journal.close()
+    assert cursor is None and len(records) == 21
+    failed, latest = records[0], records[1]
+    assert failed["status"] == 502 and failed["error"] == "boom" and failed["response"] is None
+    assert latest["response"] == "ok" and latest["model"] == "gpt-4o" and latest["latencyMs"] == 250.0
+    assert latest["usage"] == {"promptTokens": 7, "completionTokens": 3, "totalTokens": 10}
+    # Credentials never reach the journal
+    assert "apiKey" not in latest["request"]
+    assert not any(b"sk-secret" in open(os.path.join(tmp_path, name), "rb").read() for name in os.listdir(tmp_path))
+
+
+@pytest.mark.anyio
+async def test_query_filters_and_pages(tmp_path):
+    journal = Journal(str(tmp_path))
+    await journal.start()
+    for i in range(5):
+        call(journal, owner="s1", agent="WriterAgent" if i % 2 else "PlannerAgent", ts=1000.0 + i)
+    call(journal, owner="s2", flow="f2", ts=1010.0)
+    await asyncio.sleep(0.05)
+    first, cursor = journal.query(session="s1", limit=2)
+    second, cursor = journal.query(session="s1", limit=2, before=cursor)
+    third, cursor = journal.query(session="s1", limit=2, before=cursor)
+    assert [r["ts"] for r in first + second + third] == [1004.0, 1003.0, 1002.0, 1001.0, 1000.0]
+    assert cursor is None
+    assert len(journal.query(session="s1", agent="WriterAgent")[0]) == 2
+    assert len(journal.query(session="s1", since=1001.0, until=1003.0)[0]) == 2
+    assert [r["session"] for r in journal.query(flow_id="f2")[0]] == ["s2"]
+    await journal.aclose()
+
+
+@pytest.mark.anyio
+async def test_segments_rotate_and_expire(tmp_path):
+    clock = Clock()
+    journal = Journal(str(tmp_path), segment_seconds=60, max_segments=2, clock=clock)
+    await journal.start()
+    for i in range(4):
+        call(journal, ts=clock.now)
+        await asyncio.sleep(0.05)
+        clock.now += 61
+    await journal.aclose()
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("calls-")]) == 2
+    journal.open()
+    # Index rows of deleted segments go with them
+    assert [r["ts"] for r in journal.query()[0]] == [1183.0, 1122.0]
+    journal.close()
+
+
+@pytest.mark.anyio
+async def test_full_queue_drops_instead_of_blocking(tmp_path):
+    journal = Journal(str(tmp_path), queue_size=2)
+    await journal.start()
+    for _ in range(5):
+        call(journal)
+    assert journal.dropped == 3
+    await journal.aclose()
+    assert journal.written == 2
+
+
+def test_torn_lines_are_recovered(tmp_path):
+    async def write():
+        journal = Journal(str(tmp_path))
+        await journal.start()
+        call(journal)
+        await journal.aclose()
+
+    asyncio.run(write())
+    segment = next(name for name in os.listdir(tmp_path) if name.startswith("calls-"))
+    with open(tmp_path / segment, "rb") as f:
+        line = f.read()
+    # A crash after the file write but before the index commit, then mid-write
+    with open(tmp_path / segment, "ab") as f:
+        f.write(line + line[:10])
+    journal = Journal(str(tmp_path))
+    journal.open()
+    assert len(journal.query()[0]) == 2
+    journal.close()
+    assert os.path.getsize(tmp_path / segment) == 2 * len(line)
+
+
+@pytest.mark.anyio
+async def test_workers_share_a_directory(tmp_path):
+    worker_a = Journal(str(tmp_path), clock=lambda: 1000.0)
+    worker_b = Journal(str(tmp_path), clock=lambda: 1001.0)
+    await worker_a.start()
+    call(worker_a, owner="a")
+    await asyncio.sleep(0.05)
+    segment = tmp_path / worker_a.stats()["segment"]
+    # worker_a has written a line but not indexed it yet
+    line = segment.read_bytes()
+    with open(segment, "ab") as f:
+        f.write(line)
+    await worker_b.start()
+    assert segment.read_bytes() == 2 * line
+    call(worker_b, owner="b")
+    await asyncio.sleep(0.05)
+    assert worker_b.stats()["segment"] != worker_a.stats()["segment"]
+    # Either worker's queries see both workers' calls
+    assert sorted(r["session"] for r in worker_a.query()[0]) == ["a", "b"]
+    assert sorted(r["session"] for r in worker_b.query()[0]) == ["a", "b"]
+    await worker_a.aclose()
+    await worker_b.aclose()
+    # Once its writer is gone, the segment's unindexed tail is recovered
+    restarted = Journal(str(tmp_path))
+    restarted.open()
+    assert sorted(r["session"] for r in restarted.query()[0]) == ["a", "a", "b"]
+    restarted.close()
+
+
+def test_calls_api_only_shows_the_callers_session(journaled):
+    with TestClient(app) as c:
+        def login():
+            c.cookies.clear()
+            c.post("/api/session/set_key", json={"provider": "openai", "apiKey": "k"})
+            return c.cookies["session_id"]
+
+        alice = login()
+        for i in range(3):
+            c.post("/api/llm/openai", json={"messages": [{"role": "user", "content": f"q{i}"}]})
+        bob = login()
+        c.post("/api/llm/openai", json={"messages": [{"role": "user", "content": "bob"}], "normalize": True})
+        c.post("/api/llm/openai", json={"messages": [], "stream": True})
+        # The writer drains in the background; wait for all five calls
+        for _ in range(100):
+            if journaled.written == 5:
+                break
+            time.sleep(0.01)
+        bobs = c.get("/api/llm/calls").json()
+        c.cookies.set("session_id", alice)
+        page = c.get("/api/llm/calls", params={"limit": 2}).json()
+        rest = c.get("/api/llm/calls", params={"limit": 2, "before": page["nextCursor"]}).json()
+        assert c.get("/api/llm/calls", params={"limit": "x"}).status_code == 400
+        c.cookies.clear()
+        anonymous = c.get("/api/llm/calls").json()
+    assert alice != bob
+    assert [c["request"]["messages"][0]["content"] for c in page["calls"] + rest["calls"]] == ["q2", "q1", "q0"]
+    assert rest["nextCursor"] is None
+    assert [c["stream"] for c in bobs["calls"]] == [True, False]
+    assert bobs["calls"][1]["cache"] == "BYPASS"
+    assert anonymous == {"calls": [], "nextCursor": None}
+
+
+def test_calls_api_is_off_by_default():
+    with TestClient(app) as c:
+        assert c.get("/api/llm/calls").status_code == 404
+
+
+@pytest.mark.anyio
+async def test_replay_reads_a_flow(tmp_path):
+    journal = Journal(str(tmp_path))
+    await journal.start()
+    call(journal, flow="f1", ts=1001.0)
+    call(journal, flow="f1", ts=1000.0)
+    call(journal, flow="f2", ts=1002.0)
+    await journal.aclose()
+    records = load(str(tmp_path), flow="f1")
+    assert [r["ts"] for r in records] == [1000.0, 1001.0]
+    body = replay_body(records[0])
+    assert body["max_tokens"] == 3 and body["cache"] == "bypass" and body["model"] == "gpt-4o"
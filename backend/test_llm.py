@@ -1,6 +1,6 @@
+import httpx
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch
 from app import app
 import os
 import secrets
@@ -25,99 +25,89 @@ def save_databricks_key():
         c.post("/api/session/set_key", json={"provider": "databricks", "apiKey": "test-databricks-key", "apiUrl": "https://fake-databricks.com"})
         return c
 
-def test_openai_llm_env(monkeypatch):
+def test_openai_llm_env(monkeypatch, mock_app):
     monkeypatch.setenv("OPENAI_API_KEY", "env-openai-key")
+    def handler(request):
+        assert request.headers["Authorization"] == "Bearer env-openai-key"
+        return httpx.Response(200, json={"choices": [{"message": {"content": "OpenAI ENV response"}}]})
+    mock_app(handler)
     with TestClient(app) as c:
-        with patch("app.requests.post") as mock_post:
-            mock_post.return_value.status_code = 200
-            mock_post.return_value.json.return_value = {"choices": [{"message": {"content": "OpenAI ENV response"}}]}
-            response = c.post("/api/llm/openai", json={
-                "messages": [{"role": "user", "content": "test"}],
-                "model": "gpt-4",
-                "provider": "openai"
-            })
-            assert response.status_code == 200
-            assert "OpenAI ENV response" in str(response.json())
+        response = c.post("/api/llm/openai", json={
+            "messages": [{"role": "user", "content": "test"}],
+            "model": "gpt-4",
+            "provider": "openai"
+        })
+        assert response.status_code == 200
+        assert "OpenAI ENV response" in str(response.json())
 
-def test_anthropic_llm_env(monkeypatch):
+def test_anthropic_llm_env(monkeypatch, mock_app):
     monkeypatch.setenv("ANTHROPIC_API_KEY", "env-anthropic-key")
+    def handler(request):
+        assert request.headers["x-api-key"] == "env-anthropic-key"
+        return httpx.Response(200, json={"content": [{"type": "text", "text": "Anthropic ENV response"}]})
+    mock_app(handler)
     with TestClient(app) as c:
-        with patch("app.requests.post") as mock_post:
-            mock_post.return_value.status_code = 200
-            mock_post.return_value.json.return_value = {"content": [{"type": "text", "text": "Anthropic ENV response"}]}
-            response = c.post("/api/llm/anthropic", json={
-                "messages": [{"role": "user", "content": "test"}],
-                "model": "claude-3-opus-20240229",
-                "provider": "anthropic"
-            })
-            assert response.status_code == 200
-            assert "Anthropic ENV response" in str(response.json())
+        response = c.post("/api/llm/anthropic", json={
+            "messages": [{"role": "user", "content": "test"}],
+            "model": "claude-3-opus-20240229",
+            "provider": "anthropic"
+        })
+        assert response.status_code == 200
+        assert "Anthropic ENV response" in str(response.json())
 
-def test_databricks_llm_env(monkeypatch):
+def test_databricks_llm_env(monkeypatch, mock_app):
     monkeypatch.setenv("DATABRICKS_API_KEY", "env-databricks-key")
     monkeypatch.setenv("DATABRICKS_API_URL", "https://fake-databricks.com")
+    def handler(request):
+        assert request.headers["Authorization"] == "Bearer env-databricks-key"
+        assert request.url.host == "fake-databricks.com"
+        return httpx.Response(200, json={"inputs": [{"prompt": "Databricks ENV response"}]})
+    mock_app(handler)
     with TestClient(app) as c:
-        with patch("app.requests.post") as mock_post:
-            mock_post.return_value.status_code = 200
-            mock_post.return_value.json.return_value = {"inputs": [{"prompt": "Databricks ENV response"}]}
-            response = c.post("/api/llm/databricks", json={
-                "messages": [{"role": "user", "content": "test"}],
-                "model": "databricks-dbrx-instruct",
-                "provider": "databricks",
-                "apiUrl": "https://fake-databricks.com"
-            })
-            assert response.status_code == 200
-            assert "Databricks ENV response" in str(response.json())
+        response = c.post("/api/llm/databricks", json={
+            "messages": [{"role": "user", "content": "test"}],
+            "model": "databricks-dbrx-instruct",
+            "provider": "databricks",
+            "apiUrl": "https://fake-databricks.com"
+        })
+        assert response.status_code == 200
+        assert "Databricks ENV response" in str(response.json())
 
-def test_anthropic_session_integration():
+def test_anthropic_session_integration(monkeypatch, mock_app):
     anthropic_key = os.environ.get("ANTHROPIC_API_KEY", "dummy-key")
+    def handler(request):
+        assert request.headers["x-api-key"] == anthropic_key
+        return httpx.Response(200, json={"content": [{"type": "text", "text": "Anthropic Session Integration Success"}]})
+    mock_app(handler)
     with TestClient(app) as c:
         resp = c.post("/api/session/set_key", json={"provider": "anthropic", "apiKey": anthropic_key})
         assert resp.status_code == 200
-        def fake_post(url, headers=None, json=None):
-            assert headers["x-api-key"] == anthropic_key
-            class DummyResp:
-                status_code = 200
-                def json(self):
-                    return {"content": [{"type": "text", "text": "Anthropic Session Integration Success"}]}
-                @property
-                def text(self):
-                    return "Anthropic Session Integration Success"
-            return DummyResp()
-        with patch("app.requests.post", side_effect=fake_post):
-            response = c.post("/api/llm/anthropic", json={
-                "messages": [{"role": "user", "content": "test"}],
-                "model": "claude-3-opus-20240229",
-                "provider": "anthropic"
-            })
-            assert response.status_code == 200
-            assert "Anthropic Session Integration Success" in str(response.json())
+        response = c.post("/api/llm/anthropic", json={
+            "messages": [{"role": "user", "content": "test"}],
+            "model": "claude-3-opus-20240229",
+            "provider": "anthropic"
+        })
+        assert response.status_code == 200
+        assert "Anthropic Session Integration Success" in str(response.json())
 
-def test_databricks_session_integration():
+def test_databricks_session_integration(monkeypatch, mock_app):
     databricks_key = os.environ.get("DATABRICKS_API_KEY", "dummy-key")
     databricks_url = os.environ.get("DATABRICKS_API_URL", "https://fake-databricks.com")
+    def handler(request):
+        assert request.headers["Authorization"] == f"Bearer {databricks_key}"
+        return httpx.Response(200, json={"inputs": [{"prompt": "Databricks Session Integration Success"}]})
+    mock_app(handler)
     with TestClient(app) as c:
         resp = c.post("/api/session/set_key", json={"provider": "databricks", "apiKey": databricks_key, "apiUrl": databricks_url})
         assert resp.status_code == 200
-        def fake_post(url, headers=None, json=None):
-            assert headers["Authorization"] == f"Bearer {databricks_key}"
-            class DummyResp:
-                status_code = 200
-                def json(self):
-                    return {"inputs": [{"prompt": "Databricks Session Integration Success"}]}
-                @property
-                def text(self):
-                    return "Databricks Session Integration Success"
-            return DummyResp()
-        with patch("app.requests.post", side_effect=fake_post):
-            response = c.post("/api/llm/databricks", json={
-                "messages": [{"role": "user", "content": "test"}],
-                "model": "databricks-dbrx-instruct",
-                "provider": "databricks",
-                "apiUrl": databricks_url
-            })
-            assert response.status_code == 200
-            assert "Databricks Session Integration Success" in str(response.json())
+        response = c.post("/api/llm/databricks", json={
+            "messages": [{"role": "user", "content": "test"}],
+            "model": "databricks-dbrx-instruct",
+            "provider": "databricks",
+            "apiUrl": databricks_url
+        })
+        assert response.status_code == 200
+        assert "Databricks Session Integration Success" in str(response.json())
 
 def test_missing_key():
     with TestClient(app) as c:
@@ -129,21 +119,15 @@ def test_missing_key():
         assert response.status_code == 400
         assert "API key is required" in response.text
 
-def test_session_helper_unit():
-    # Simulate the session dict as used in get_api_key
-    from types import SimpleNamespace
-    class DummyRequest:
-        def __init__(self, session):
-            self.session = session
-            self.scope = {"session": True}
-    # Simulate a session with a stored key
-    session = {"llm_keys": {"openai": {"apiKey": "unit-test-key"}}}
-    dummy_data = SimpleNamespace(apiKey=None)
-    from app import get_api_key
-    import asyncio
-    req = DummyRequest(session)
-    key = asyncio.run(get_api_key(req, "openai", dummy_data))
-    assert key == "unit-test-key"
+def test_session_helper_unit(monkeypatch):
+    # Credentials resolve from the request body, then the session, then the environment
+    from providers import ADAPTERS
+    monkeypatch.setenv("OPENAI_API_KEY", "env-key")
+    openai = ADAPTERS["openai"]
+    session = {"openai_apiKey": "unit-test-key"}
+    assert openai.resolve({}, session, "apiKey", "OPENAI_API_KEY") == "unit-test-key"
+    assert openai.resolve({"apiKey": "body-key"}, session, "apiKey", "OPENAI_API_KEY") == "body-key"
+    assert openai.resolve({}, {}, "apiKey", "OPENAI_API_KEY") == "env-key"
 
 def test_openai_real_integration():
     openai_key = os.environ.get("OPENAI_API_KEY")
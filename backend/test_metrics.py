@@ -0,0 +1,147 @@
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from metrics import (LATENCY_BUCKETS, MAX_MODELS_PER_PROVIDER, MIN_PROFILE_INTERVAL, Histogram, Metrics,
+                     SamplingProfiler, scan_usage)
+from resilience import ResilienceConfig
+from test_streaming import OPENAI_SSE, TrackingStream
+
+
+@pytest.fixture
+def upstream(mock_app):
+    def handler(request):
+        if b'"stream":true' in request.content:
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=TrackingStream(OPENAI_SSE))
+        if b"fail" in request.content:
+            return httpx.Response(500, json={"error": "boom"})
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"prompt_tokens": 11, "completion_tokens": 4, "total_tokens": 15},
+        })
+
+    return mock_app(handler, resilience=ResilienceConfig(max_retries=0), metrics=Metrics()).metrics
+
+
+def ask(c, content="hi", **fields):
+    body = {"apiKey": "k", "model": "gpt-4o", "messages": [{"role": "user", "content": content}], **fields}
+    return c.post("/api/llm/openai", json=body)
+
+
+def sample(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_prefix} not in metrics")
+
+
+def test_histogram_buckets():
+    hist = Histogram(LATENCY_BUCKETS)
+    hist.observe(0.003)
+    hist.observe(0.005)
+    hist.observe(500)
+    assert hist.counts[LATENCY_BUCKETS.index(0.005)] == 2
+    assert hist.counts[-1] == 1
+    assert hist.count == 3
+
+
+def test_scan_usage():
+    assert scan_usage(b'{"choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 9}}') == (3, 9)
+    assert scan_usage(b'{"content": [], "usage": {"input_tokens": 5, "output_tokens": 2}}') == (5, 2)
+    assert scan_usage(b'{"choices": []}') == (0, 0)
+
+
+def test_model_labels_are_bounded():
+    metrics = Metrics()
+    for i in range(MAX_MODELS_PER_PROVIDER + 5):
+        metrics.series("openai", f"model-{i}")
+    assert metrics.series("openai", "yet-another") is metrics.series("openai", "other")
+
+
+def test_exposition_covers_calls_errors_and_tokens(upstream):
+    with TestClient(app) as c:
+        ask(c)
+        ask(c)
+        assert ask(c, "fail").status_code == 500
+        ask(c, "cached", temperature=0)
+        ask(c, "cached", temperature=0)
+        text = c.get("/api/metrics").text
+    labels = 'provider="openai",model="gpt-4o"'
+    assert sample(text, f"llm_proxy_requests_total{{{labels}}}") == 5
+    assert sample(text, f'llm_proxy_errors_total{{{labels},class="upstream_5xx"}}') == 1
+    # Three upstream successes; the cache hit adds no tokens
+    assert sample(text, f"llm_proxy_prompt_tokens_total{{{labels}}}") == 33
+    assert sample(text, f"llm_proxy_completion_tokens_total{{{labels}}}") == 12
+    assert sample(text, f"llm_proxy_upstream_seconds_count{{{labels}}}") == 4
+    assert sample(text, f"llm_proxy_overhead_seconds_count{{{labels}}}") == 5
+    assert sample(text, f"llm_proxy_request_bytes_count{{{labels}}}") == 5
+    assert sample(text, f'llm_proxy_upstream_seconds_bucket{{{labels},le="+Inf"}}') == 4
+    assert sample(text, "llm_cache_entries") == 1
+
+
+def test_streaming_records_ttfb_and_usage(upstream):
+    with TestClient(app) as c:
+        ask(c, stream=True)
+        text = c.get("/api/metrics").text
+    labels = 'provider="openai",model="gpt-4o"'
+    assert sample(text, f"llm_proxy_ttfb_seconds_count{{{labels}}}") == 1
+    assert sample(text, f"llm_proxy_prompt_tokens_total{{{labels}}}") == 5
+    assert sample(text, f"llm_proxy_completion_tokens_total{{{labels}}}") == 2
+    assert sample(text, f"llm_proxy_overhead_seconds_count{{{labels}}}") == 1
+
+
+def test_bad_requests_are_counted(upstream):
+    with TestClient(app) as c:
+        assert c.post("/api/llm/openai", json={"messages": []}).status_code == 400
+        text = c.get("/api/metrics").text
+    assert sample(text, 'llm_proxy_errors_total{provider="openai",model="-",class="bad_request"}') == 1
+
+
+def test_unknown_paths_add_no_series(upstream):
+    with TestClient(app) as c:
+        for i in range(5):
+            assert c.post(f"/api/llm/bogus-{i}", json={}).status_code in (404, 405)
+        c.get("/api/llm/calls")
+        text = c.get("/api/metrics").text
+    assert "bogus" not in text and 'provider="calls"' not in text
+    assert not upstream._series
+
+
+def test_profiler_collects_samples():
+    profiler = SamplingProfiler()
+    profiler.start(interval=0.001)
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+    profiler.stop()
+    assert not profiler.running
+    assert profiler.status()["samples"] > 0
+    assert "test_profiler_collects_samples" in profiler.collapsed()
+
+
+def test_profiler_toggles_at_runtime(upstream):
+    with TestClient(app) as c:
+        assert c.post("/api/metrics/profile", json={"enabled": True, "interval": 0.001}).json()["running"]
+        ask(c)
+        status = c.post("/api/metrics/profile", json={"enabled": False}).json()
+        assert not status["running"]
+        assert c.get("/api/metrics/profile").status_code == 200
+
+
+def test_profiler_interval_is_bounded():
+    profiler = SamplingProfiler()
+    for interval in (0, -1, float("nan")):
+        with pytest.raises(ValueError):
+            profiler.start(interval)
+    assert not profiler.running
+    profiler.start(1e-9)
+    profiler.stop()
+    assert profiler.interval == MIN_PROFILE_INTERVAL
+    with TestClient(app) as c:
+        for interval in (-1, "fast"):
+            response = c.post("/api/metrics/profile", json={"enabled": True, "interval": interval})
+            assert response.status_code == 400
+        assert not c.post("/api/metrics/profile", json={}).json()["running"]
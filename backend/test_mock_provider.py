@@ -0,0 +1,58 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from mock_provider import MockConfig, create_app
+from resilience import ResilienceConfig
+from test_streaming import parse_events
+
+BASE = "http://mock.local"
+
+
+@pytest.fixture
+def mock(mock_app, monkeypatch):
+    """Route every provider to the mock provider app, in-process."""
+    config = MockConfig(latency=0, tokens=5)
+    provider = create_app(config)
+    mock_app(httpx.ASGITransport(app=provider), resilience=ResilienceConfig(max_retries=0))
+    monkeypatch.setenv("OPENAI_API_URL", f"{BASE}/v1/chat/completions")
+    monkeypatch.setenv("ANTHROPIC_API_URL", f"{BASE}/v1/messages")
+    monkeypatch.setenv("DATABRICKS_API_URL", f"{BASE}/serving-endpoints/mock/invocations")
+    for name in ("OPENAI", "ANTHROPIC", "DATABRICKS"):
+        monkeypatch.setenv(f"{name}_API_KEY", "mock-key")
+    return config
+
+
+def ask(c, provider, **fields):
+    return c.post(f"/api/llm/{provider}", json={"messages": [{"role": "user", "content": "hello"}], **fields})
+
+
+@pytest.mark.parametrize("provider", ["openai", "anthropic", "databricks"])
+def test_completion_formats(mock, provider):
+    with TestClient(app) as c:
+        body = ask(c, provider, normalize=True).json()
+    assert body["content"] == "token0 token1 token2 token3 token4 "
+    assert body["usage"]["completionTokens"] == 5
+    assert body["usage"]["promptTokens"] > 0
+
+
+@pytest.mark.parametrize("provider", ["openai", "anthropic", "databricks"])
+def test_streaming_formats(mock, provider):
+    with TestClient(app) as c:
+        events = parse_events(ask(c, provider, stream=True).text)
+    deltas = "".join(data["content"] for event, data in events if event == "delta")
+    assert deltas == "token0 token1 token2 token3 token4 "
+    usage = dict(events)["usage"]
+    # Chat-completions streams only carry usage when asked for it, which the proxy does for OpenAI
+    assert usage["completionTokens"] == (0 if provider == "databricks" else 5)
+    assert events[-1][0] == "done"
+
+
+def test_error_injection(mock):
+    mock.error_rate = 1.0
+    mock.error_status = 503
+    with TestClient(app) as c:
+        response = ask(c, "openai")
+    assert response.status_code == 503
+    assert "injected failure" in response.text
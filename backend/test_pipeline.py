@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from pipeline import DEFAULT_STAGES, FlowEngine, FlowLimitExceeded, Stage, validate_stages
+
+
+def reply(provider, text):
+    # Normalized reply, as the engine's call() returns it
+    return {"content": text, "model": "m", "usage": {"promptTokens": 3, "completionTokens": 2, "totalTokens": 5}}
+
+
+def upstream_reply(text):
+    return {"choices": [{"message": {"content": text}}], "usage": {"prompt_tokens": 3, "completion_tokens": 2}}
+
+
+def echo_call(delay=0.0, log=None):
+    # Reply with the first words of the user prompt so stage wiring is visible
+    async def call(provider, data):
+        if log is not None:
+            log.append((provider, data))
+        await asyncio.sleep(delay)
+        return 200, reply(provider, "out:" + data["messages"][-1]["content"][:20])
+    return call
+
+
+@pytest.mark.anyio
+async def test_default_flow_runs_stages_in_order():
+    engine = FlowEngine()
+    log = []
+    flow = engine.start("AI in healthcare", echo_call(log=log), agent_llms={"ReviewerAgent": "anthropic"},
+                        llms={"openai": {"model": "gpt-4o"}})
+    await engine.wait(flow.id)
+    assert flow.status == "completed"
+    events = [record["event"] for record in flow.events if not record["event"].startswith("llm_")]
+    assert events == ["planReady", "researchReady", "draftReady", "reviewComplete", "rewriteComplete"]
+    assert flow.outputs["research"] == "out:Research the followi"
+    assert [provider for provider, _ in log] == ["openai", "openai", "openai", "anthropic", "openai"]
+    assert log[0][1]["model"] == "gpt-4o"
+    response = next(r["message"] for r in flow.events if r["event"] == "llm_response")
+    assert response["usage"] == {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5}
+
+
+@pytest.mark.anyio
+async def test_independent_stages_run_concurrently():
+    stages = (
+        Stage("plan", "PlannerAgent", "ResearchAgent", "planReady", lambda o: [{"role": "user", "content": o["goal"]}]),
+        *(Stage(f"topic{i}", "ResearchAgent", "WriterAgent", "researchReady",
+                lambda o, i=i: [{"role": "user", "content": f"{o['plan']} #{i}"}], ("plan",)) for i in range(4)),
+        Stage("draft", "WriterAgent", "User", "draftReady",
+              lambda o: [{"role": "user", "content": " ".join(o[f"topic{i}"] for i in range(4))}],
+              tuple(f"topic{i}" for i in range(4))),
+    )
+    engine = FlowEngine()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    flow = engine.start("goal", echo_call(delay=0.05), stages=stages)
+    await engine.wait(flow.id)
+    # plan, then four parallel topics, then draft: three rounds, not six
+    assert flow.status == "completed"
+    assert loop.time() - started < 0.25
+
+
+@pytest.mark.anyio
+async def test_failed_stage_fails_flow():
+    async def call(provider, data):
+        return 429, {"error": "rate limited"}
+
+    engine = FlowEngine()
+    flow = engine.start("goal", call)
+    await engine.wait(flow.id)
+    assert flow.status == "failed"
+    assert "rate limited" in flow.error
+    assert flow.events[-1]["event"] == "error"
+
+
+@pytest.mark.anyio
+async def test_many_flows_in_flight():
+    engine = FlowEngine(max_active=100)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    flows = [engine.start(f"goal {i}", echo_call(delay=0.02)) for i in range(100)]
+    await asyncio.gather(*(engine.wait(flow.id) for flow in flows))
+    assert all(flow.status == "completed" for flow in flows)
+    # 100 five-stage flows overlap instead of running back to back (10s)
+    assert loop.time() - started < 1.0
+
+
+@pytest.mark.anyio
+async def test_flows_past_the_in_flight_bound_are_refused():
+    engine = FlowEngine(max_active=2, max_in_flight=4)
+    flows = [engine.start(f"goal {i}", echo_call(delay=0.02)) for i in range(4)]
+    with pytest.raises(FlowLimitExceeded):
+        engine.start("one too many", echo_call())
+    await asyncio.gather(*(engine.wait(flow.id) for flow in flows))
+    # Finished flows free their slots
+    await engine.wait(engine.start("goal", echo_call()).id)
+
+
+def test_validate_stages_rejects_cycles_and_unknown_deps():
+    validate_stages(DEFAULT_STAGES)
+    with pytest.raises(ValueError):
+        validate_stages((Stage("a", "A", "B", "e", list, ("b",)), Stage("b", "B", "A", "e", list, ("a",))))
+    with pytest.raises(ValueError):
+        validate_stages((Stage("a", "A", "B", "e", list, ("missing",)),))
+
+
+def test_flow_over_http_and_websocket(mock_app):
+    def handler(request):
+        prompt = json.loads(request.content)["messages"][-1]["content"]
+        return httpx.Response(200, json=upstream_reply(prompt[:10]))
+
+    flows = mock_app(handler, flows=FlowEngine()).flows
+    with TestClient(app) as c:
+        c.post("/api/session/set_key", json={"provider": "openai", "apiKey": "session-key"})
+        assert c.post("/api/flows", json={"goal": " "}).status_code == 400
+        flows.max_in_flight = 0
+        assert c.post("/api/flows", json={"goal": "AI in healthcare"}).status_code == 429
+        flows.max_in_flight = 256
+        flow_id = c.post("/api/flows", json={"goal": "AI in healthcare"}).json()["id"]
+        with c.websocket_connect(f"/api/flows/{flow_id}/ws") as ws:
+            records = []
+            while True:
+                records.append(ws.receive_json())
+                if records[-1]["event"] == "flowComplete":
+                    break
+        summary = c.get(f"/api/flows/{flow_id}").json()
+        assert c.get("/api/flows/unknown").status_code == 404
+    names = [r["event"] for r in records]
+    assert names.count("llm_request") == 5
+    assert names[-2:] == ["rewriteComplete", "flowComplete"]
+    assert summary["status"] == "completed"
+    assert summary["outputs"]["plan"] == "AI in heal"
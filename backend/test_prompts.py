@@ -0,0 +1,146 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from prompts import MIN_CACHE_TOKENS, PrefixTracker, add_cache_breakpoints, compact, compact_request
+from providers import ADAPTERS
+
+# Comfortably above MIN_CACHE_TOKENS with either token counter
+LONG = "The plan covers scope, sources and structure in detail. " * (MIN_CACHE_TOKENS // 5)
+PARAGRAPH = "Research finding: " + "solar output rose sharply across the region last year. " * 8
+
+
+@pytest.fixture
+def upstream(mock_app, monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(json.loads(request.content))
+        if "anthropic" in request.url.host:
+            return httpx.Response(200, json={"content": [{"type": "text", "text": "ok"}],
+                                             "usage": {"input_tokens": 2000, "output_tokens": 5,
+                                                       "cache_read_input_tokens": 1500}})
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    mock_app(handler)
+    monkeypatch.setattr(ADAPTERS["anthropic"], "prefixes", PrefixTracker())
+    return calls
+
+
+def test_dedup_drops_repeated_messages_and_paragraphs():
+    messages = [
+        {"role": "user", "content": f"Plan this.\n\n{PARAGRAPH}"},
+        {"role": "assistant", "content": "Done."},
+        {"role": "assistant", "content": "Done."},
+        {"role": "assistant", "content": f"{PARAGRAPH}\n\nDrafted."},
+        {"role": "user", "content": "Now write it."},
+    ]
+    compacted, report = compact(messages)
+    assert [m["content"] for m in compacted] == [f"Plan this.\n\n{PARAGRAPH}", "Done.", "Drafted.", "Now write it."]
+    assert report["dedupedBlocks"] == 2
+    assert report["tokensSaved"] == report["promptTokensBefore"] - report["promptTokensAfter"] > 0
+
+
+def test_dedup_sends_the_latest_message_whole():
+    resent = [{"role": "user", "content": PARAGRAPH}, {"role": "assistant", "content": "ok"},
+              {"role": "user", "content": PARAGRAPH}]
+    assert compact(resent)[0][-1] == {"role": "user", "content": PARAGRAPH}
+    review = [{"role": "assistant", "content": f"Draft:\n\n{PARAGRAPH}"},
+              {"role": "user", "content": f"Review this content:\n\n{PARAGRAPH}"}]
+    assert compact(review)[0][-1]["content"] == f"Review this content:\n\n{PARAGRAPH}"
+
+
+def test_budget_drops_oldest_turns_then_truncates():
+    messages = [
+        {"role": "system", "content": "You are a writer."},
+        {"role": "user", "content": "old question " * 200},
+        {"role": "assistant", "content": "old answer " * 200},
+        {"role": "user", "content": "latest " * 1000},
+    ]
+    compacted, report = compact(messages, budget=500)
+    assert [m["role"] for m in compacted] == ["system", "user"]
+    assert "tokens truncated" in compacted[-1]["content"]
+    assert report["droppedMessages"] == 2 and report["truncatedMessages"] == 1
+    assert report["promptTokensAfter"] <= 500
+
+
+def test_truncation_marker_counts_against_the_budget():
+    messages = [
+        {"role": "system", "content": "You are a planner."},
+        {"role": "user", "content": f"Plan this.\n\n{PARAGRAPH}"},
+        {"role": "assistant", "content": "Step one, step two."},
+        {"role": "user", "content": "Now expand every step in detail. " * 40},
+    ]
+    for budget in (100, 150, 300):
+        _, report = compact(messages, budget=budget)
+        assert report["truncatedMessages"] == 1
+        assert report["promptTokensAfter"] <= budget
+
+
+def test_compact_request_options(monkeypatch):
+    data = {"messages": [{"role": "user", "content": "hi"}]}
+    assert compact_request(data) == (data, None)
+    assert compact_request(dict(data, compact=True))[1]["tokensSaved"] == 0
+    with pytest.raises(ValueError):
+        compact_request(dict(data, compact={"budget": "lots"}))
+
+
+def test_breakpoints_follow_reused_prefixes():
+    tracker = PrefixTracker()
+    first = {"model": "claude", "system": LONG, "messages": [{"role": "user", "content": "Write the draft."}]}
+    marked, count = add_cache_breakpoints(first, tracker)
+    # Long system prompts are cached from the first call
+    assert count == 1 and marked["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert first["system"] == LONG
+
+    second = dict(first, messages=first["messages"] + [
+        {"role": "assistant", "content": "Draft text."}, {"role": "user", "content": "Now revise it."}])
+    marked, count = add_cache_breakpoints(second, tracker)
+    # The previous call's whole prompt is a reused prefix; the new end is marked for the next turn
+    assert count == 3
+    assert marked["messages"][0]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert marked["messages"][2]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert isinstance(marked["messages"][1]["content"], str)
+
+
+def test_short_prompts_are_left_alone():
+    payload = {"model": "claude", "messages": [{"role": "user", "content": "hi"}]}
+    assert add_cache_breakpoints(payload, PrefixTracker()) == (payload, 0)
+
+
+def test_anthropic_system_messages_become_the_system_field():
+    payload = ADAPTERS["anthropic"].payload({"messages": [
+        {"role": "system", "content": "You are a planner."},
+        {"role": "user", "content": "Plan."},
+    ]}, "claude")
+    assert payload["system"] == "You are a planner."
+    assert payload["messages"] == [{"role": "user", "content": "Plan."}]
+
+
+def test_proxy_injects_breakpoints_without_changing_cache_keys(upstream):
+    body = {"apiKey": "k", "temperature": 0,
+            "messages": [{"role": "system", "content": LONG}, {"role": "user", "content": "Plan."}]}
+    with TestClient(app) as c:
+        first = c.post("/api/llm/anthropic", json=body)
+        second = c.post("/api/llm/anthropic", json=body)
+        c.post("/api/llm/anthropic", json=dict(body, promptCache=False, cache="bypass"))
+    assert upstream[0]["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert upstream[1]["system"] == LONG
+    assert second.headers["x-cache"] == "HIT"
+    assert first.headers["x-prompt-cache-read-tokens"] == "1500"
+
+
+def test_compaction_report_headers(upstream):
+    messages = [{"role": "user", "content": PARAGRAPH},
+                {"role": "assistant", "content": PARAGRAPH + "\n\nShorter now?"},
+                {"role": "user", "content": "Go on."}]
+    with TestClient(app) as c:
+        response = c.post("/api/llm/openai", json={"apiKey": "k", "messages": messages, "compact": True})
+        assert c.post("/api/llm/openai", json={"apiKey": "k", "messages": messages,
+                                               "compact": {"budget": "x"}}).status_code == 400
+    assert int(response.headers["x-prompt-tokens-saved"]) > 0
+    assert int(response.headers["x-prompt-tokens-after"]) < int(response.headers["x-prompt-tokens-before"])
+    assert upstream[0]["messages"][1]["content"] == "Shorter now?"
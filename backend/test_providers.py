@@ -0,0 +1,79 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from batch import _line
+from providers import ADAPTERS, ProxyError, RawBody
+
+# Deliberately odd formatting: passthrough must not re-serialize it
+OPENAI_BODY = b'{"model":"gpt-4o",  "choices":[{"message":{"content":"hi"}}],"usage":{"prompt_tokens":4,"completion_tokens":1}}'
+ANTHROPIC_BODY = b'{"model":"claude-3","content":[{"type":"text","text":"a"},{"type":"text","text":"b"}],"usage":{"input_tokens":6,"output_tokens":2}}'
+
+
+@pytest.fixture
+def upstream(mock_app):
+    def handler(request):
+        body = ANTHROPIC_BODY if "anthropic" in request.url.host else OPENAI_BODY
+        return httpx.Response(200, content=body, headers={"content-type": "application/json; charset=utf-8"})
+
+    mock_app(handler)
+
+
+def test_adapters_build_provider_requests(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    url, headers, payload = ADAPTERS["openai"].build({"apiKey": "k", "messages": []}, {"openai_model": "gpt-4o"})
+    assert url == "https://api.openai.com/v1/chat/completions"
+    assert headers == {"Authorization": "Bearer k"}
+    assert payload == {"model": "gpt-4o", "messages": [], "max_tokens": 1000, "temperature": 0.7}
+    url, headers, payload = ADAPTERS["anthropic"].build({"apiKey": "k"}, {})
+    assert headers["x-api-key"] == "k" and payload["model"] == "claude-3-opus-20240229"
+    url, _, _ = ADAPTERS["databricks"].build({}, {"databricks_apiKey": "k", "databricks_apiUrl": "https://dbx/x"})
+    assert url == "https://dbx/x"
+    with pytest.raises(ProxyError, match="API key is required"):
+        ADAPTERS["openai"].build({}, {})
+    monkeypatch.setenv("OPENAI_API_URL", "http://127.0.0.1:9999/v1/chat/completions")
+    assert ADAPTERS["openai"].build({"apiKey": "k"}, {})[0] == "http://127.0.0.1:9999/v1/chat/completions"
+
+
+def test_normalize_matches_llm_response_schema():
+    assert ADAPTERS["anthropic"].normalize(json.loads(ANTHROPIC_BODY)) == {
+        "content": "ab", "model": "claude-3",
+        "usage": {"promptTokens": 6, "completionTokens": 2, "totalTokens": 8}}
+    assert ADAPTERS["databricks"].normalize({"choices": [{"text": "t"}]}, "dbrx")["model"] == "dbrx"
+
+
+def test_default_response_is_raw_passthrough(upstream):
+    with TestClient(app) as c:
+        response = c.post("/api/llm/openai", json={"apiKey": "k", "messages": []})
+    assert response.status_code == 200
+    assert response.content == OPENAI_BODY
+    assert response.headers["content-type"] == "application/json; charset=utf-8"
+
+
+@pytest.mark.parametrize("provider,content", [("openai", "hi"), ("anthropic", "ab")])
+def test_normalize_mode(upstream, provider, content):
+    with TestClient(app) as c:
+        response = c.post(f"/api/llm/{provider}", json={"apiKey": "k", "messages": [], "normalize": True})
+    assert response.json()["content"] == content
+    assert set(response.json()) == {"content", "model", "usage"}
+
+
+def test_cached_response_is_replayed_byte_for_byte(upstream):
+    with TestClient(app) as c:
+        c.post("/api/llm/openai", json={"apiKey": "k", "messages": [], "temperature": 0})
+        hit = c.post("/api/llm/openai", json={"apiKey": "k", "messages": [], "temperature": 0})
+    assert hit.headers["x-cache"] == "HIT"
+    assert hit.content == OPENAI_BODY
+
+
+def test_batch_line_splices_raw_json():
+    line = _line(3, "openai", 200, RawBody(OPENAI_BODY, "application/json"))
+    assert OPENAI_BODY in line
+    assert json.loads(line)["body"]["choices"][0]["message"]["content"] == "hi"
+    assert json.loads(_line(0, "openai", 200, RawBody(b"plain", "text/plain")))["body"] == "plain"
+    # A body labelled JSON that isn't is relayed as a string rather than breaking the line
+    broken = _line(1, "openai", 502, RawBody(b'{"error": \n', "application/json"))
+    assert broken.count(b"\n") == 1 and json.loads(broken)["body"] == '{"error": \n'
@@ -0,0 +1,225 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from resilience import (AdaptiveLimit, CircuitBreaker, CircuitOpen, LimitExceeded, ProviderGuard, Resilience,
+                        ResilienceConfig, TokenBucket, retry_after)
+
+
+class MockProvider:
+    """Local stand-in that replays scripted (status, headers) answers, then 200s."""
+
+    def __init__(self, script=(), delay=0.0):
+        self.script = list(script)
+        self.delay = delay
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+
+    async def __call__(self, request):
+        self.calls += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        status, headers = self.script.pop(0) if self.script else (200, {})
+        if status != 200:
+            return httpx.Response(status, headers=headers, text=f"upstream {status}")
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self))
+
+
+def guard(**config):
+    return ProviderGuard("openai", ResilienceConfig(backoff_base=0.01, **config))
+
+
+@pytest.mark.anyio
+async def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=50, capacity=1)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for _ in range(5):
+        await bucket.acquire(1, time.monotonic() + 5)
+    assert loop.time() - started >= 0.07
+
+
+@pytest.mark.anyio
+async def test_token_bucket_fails_fast_past_deadline():
+    bucket = TokenBucket(rate=1, capacity=1)
+    await bucket.acquire(1, time.monotonic() + 5)
+    with pytest.raises(LimitExceeded):
+        await bucket.acquire(1, time.monotonic() + 0.1)
+
+
+@pytest.mark.anyio
+async def test_adaptive_limit_aimd():
+    limit = AdaptiveLimit(initial=8, maximum=10)
+    for _ in range(4):
+        await limit.acquire(time.monotonic() + 1)
+        limit.release(latency=0.1)
+    assert 8 < limit.limit < 9
+    await limit.acquire(time.monotonic() + 1)
+    limit.release(overloaded=True)
+    assert limit.limit < 4.6
+    await limit.acquire(time.monotonic() + 1)
+    limit.release(latency=5.0)  # spike, but within one round-trip of the last cut
+    assert limit.limit > 4
+
+
+@pytest.mark.anyio
+async def test_adaptive_limit_queues_fairly_with_deadline():
+    limit = AdaptiveLimit(initial=1)
+    await limit.acquire(time.monotonic() + 1)
+    order = []
+
+    async def waiter(name, timeout):
+        await limit.acquire(time.monotonic() + timeout)
+        order.append(name)
+        limit.release()
+
+    tasks = [asyncio.ensure_future(waiter(n, 1)) for n in ("a", "b", "c")]
+    late = asyncio.ensure_future(waiter("late", 0.01))
+    await asyncio.sleep(0.05)
+    with pytest.raises(LimitExceeded):
+        await late
+    limit.release()
+    await asyncio.gather(*tasks)
+    assert order == ["a", "b", "c"]
+    assert limit.in_flight == 0
+
+
+def test_circuit_breaker_opens_and_probes():
+    now = [0.0]
+    breaker = CircuitBreaker(failures=2, cooldown=10, clock=lambda: now[0])
+    breaker.record(False)
+    breaker.check("p")
+    breaker.record(False)
+    with pytest.raises(CircuitOpen):
+        breaker.check("p")
+    now[0] = 11
+    breaker.check("p")  # half-open: one probe allowed
+    with pytest.raises(CircuitOpen):
+        breaker.check("p")
+    breaker.record(True)
+    assert breaker.state == "closed"
+
+
+def test_retry_after_parsing():
+    assert retry_after(httpx.Response(429, headers={"retry-after": "2"})) == 2.0
+    assert retry_after(httpx.Response(429, headers={"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert retry_after(httpx.Response(429)) is None
+
+
+@pytest.mark.anyio
+async def test_retries_429_honoring_retry_after():
+    provider = MockProvider([(429, {"retry-after": "0.1"}), (503, {})])
+    g = guard()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    async with provider.client() as client:
+        resp = await g.send(lambda: client.post("http://mock/v1"))
+    assert resp.status_code == 200
+    assert provider.calls == 3
+    assert loop.time() - started >= 0.1
+    assert g.concurrency.limit < 16  # the 429 halved the limit
+
+
+@pytest.mark.anyio
+async def test_gives_up_after_max_retries():
+    provider = MockProvider([(500, {})] * 5)
+    async with provider.client() as client:
+        resp = await guard(max_retries=2).send(lambda: client.post("http://mock/v1"))
+    assert resp.status_code == 500
+    assert provider.calls == 3
+
+
+@pytest.mark.anyio
+async def test_circuit_opens_on_failing_provider():
+    provider = MockProvider([(502, {})] * 10)
+    g = guard(max_retries=0, breaker_failures=3)
+    async with provider.client() as client:
+        for _ in range(3):
+            await g.send(lambda: client.post("http://mock/v1"))
+        with pytest.raises(CircuitOpen):
+            await g.send(lambda: client.post("http://mock/v1"))
+    assert provider.calls == 3
+
+
+@pytest.mark.anyio
+async def test_slow_provider_callers_wait_in_line():
+    provider = MockProvider(delay=0.05)
+    g = guard(initial_concurrency=2, max_concurrency=2)
+    async with provider.client() as client:
+        responses = await asyncio.gather(*(g.send(lambda: client.post("http://mock/v1")) for _ in range(6)))
+    assert [r.status_code for r in responses] == [200] * 6
+    assert provider.peak == 2
+
+
+@pytest.mark.anyio
+async def test_queued_callers_time_out_instead_of_piling_on():
+    provider = MockProvider(delay=0.2)
+    g = guard(initial_concurrency=1, max_concurrency=1)
+    async with provider.client() as client:
+        results = await asyncio.gather(
+            *(g.send(lambda: client.post("http://mock/v1"), timeout=0.05) for _ in range(3)), return_exceptions=True)
+    assert results[0].status_code == 200
+    assert all(isinstance(r, LimitExceeded) for r in results[1:])
+
+
+def test_resilience_keys_guards_by_credential():
+    resilience = Resilience()
+    a = resilience.guard("openai", {"Authorization": "Bearer a"})
+    assert resilience.guard("openai", {"Authorization": "Bearer a"}) is a
+    assert resilience.guard("openai", {"Authorization": "Bearer b"}) is not a
+    assert resilience.guard("anthropic", {"x-api-key": "a"}) is not a
+
+
+def test_guard_table_is_bounded():
+    resilience = Resilience(max_guards=4)
+    busy = resilience.guard("openai", {"Authorization": "Bearer busy"})
+    busy.concurrency.in_flight = 1
+    for i in range(10):
+        resilience.guard("openai", {"Authorization": f"Bearer random-{i}"})
+    assert len(resilience._guards) == 4
+    # Guards with calls in flight are never dropped
+    assert resilience.guard("openai", {"Authorization": "Bearer busy"}) is busy
+
+
+@pytest.mark.anyio
+async def test_held_slots_last_until_released():
+    provider = MockProvider([(500, {})])
+    g = guard(initial_concurrency=1, max_concurrency=1)
+    async with provider.client() as client:
+        resp, release = await g.send(lambda: client.post("http://mock/v1"), hold=True)
+        assert resp.status_code == 200 and provider.calls == 2
+        # The retried 500 gave its slot back; the stream being relayed keeps one
+        assert g.concurrency.in_flight == 1
+        with pytest.raises(LimitExceeded):
+            await g.send(lambda: client.post("http://mock/v1"), timeout=0.05)
+        release()
+        release()
+        assert g.concurrency.in_flight == 0
+
+
+def test_proxy_retries_and_breaks_circuit(mock_app):
+    provider = MockProvider([(429, {"retry-after": "0"}), (200, {})] + [(500, {})] * 10)
+    config = ResilienceConfig(max_retries=1, breaker_failures=2, backoff_base=0.01)
+    mock_app(provider, resilience=config)
+    body = {"apiKey": "k", "messages": []}
+    with TestClient(app) as c:
+        assert c.post("/api/llm/openai", json=body).status_code == 200  # 429 retried
+        assert c.post("/api/llm/openai", json=body).status_code == 500  # 500, 500: breaker trips
+        response = c.post("/api/llm/openai", json=body)
+        stats = c.get("/api/resilience/stats").json()
+    assert response.status_code == 503
+    assert "circuit open" in response.json()["error"]
+    assert provider.calls == 4
+    assert list(stats.values())[0]["circuit"] == "open"
@@ -0,0 +1,156 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from sessions import LazySession, MemoryStore, SessionManager, SQLiteStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingStore(MemoryStore):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def load(self, sid):
+        self.reads += 1
+        return super().load(sid)
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    manager = SessionManager(CountingStore())
+    monkeypatch.setattr(app.state, "sessions", manager)
+    return manager
+
+
+def test_keys_stay_on_the_server(sessions):
+    with TestClient(app) as c:
+        c.post("/api/session/set_key", json={"provider": "openai", "apiKey": "sk-secret", "model": "gpt-4o"})
+        cookie = c.cookies["session_id"]
+        assert "sk-secret" not in cookie
+        assert c.post("/api/session/get_key", json={"provider": "openai"}).json() == {
+            "apiKey": "sk-secret", "model": "gpt-4o"}
+
+
+def test_routes_that_ignore_the_session_skip_the_store(sessions):
+    with TestClient(app) as c:
+        c.post("/api/session/set_key", json={"provider": "openai", "apiKey": "k"})
+        sessions._cache.clear()
+        response = c.get("/api/health")
+        assert "set-cookie" not in response.headers
+        assert sessions.store.reads == 0
+        c.post("/api/session/get_key", json={"provider": "openai"})
+        c.post("/api/session/get_key", json={"provider": "openai"})
+    # One store read, then served from the cache
+    assert sessions.store.reads == 1
+    assert sessions.hits == 1
+
+
+def test_llm_handlers_use_session_credentials(sessions, mock_app):
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers["Authorization"])
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    mock_app(handler)
+    with TestClient(app) as c:
+        c.post("/api/session/set_key", json={"provider": "openai", "apiKey": "from-session"})
+        assert c.post("/api/llm/openai", json={"messages": []}).status_code == 200
+    assert seen == ["Bearer from-session"]
+
+
+def test_unknown_session_ids_are_not_adopted(sessions):
+    with TestClient(app) as c:
+        response = c.post("/api/session/set_key", json={"provider": "openai", "apiKey": "k"},
+                          headers={"Cookie": "session_id=attacker-chosen"})
+    assert response.headers["set-cookie"].startswith("session_id=")
+    assert "attacker-chosen" not in response.headers["set-cookie"]
+
+
+def test_ttl_expiry_and_renewal():
+    clock = Clock()
+    manager = SessionManager(ttl=100, clock=clock)
+    manager.save("s", {"openai_apiKey": "k"})
+    clock.now += 60
+    data, expires = manager.get("s")
+    assert manager.needs_renewal(expires)
+    clock.now += 41
+    assert manager.get("s") is None
+    assert manager.store.load("s") is None
+
+
+def test_expired_sessions_leave_the_store():
+    clock = Clock()
+    manager = SessionManager(ttl=10, clock=clock)
+    for i in range(1000):
+        manager.save(f"s{i}", {"openai_apiKey": "k"})
+    clock.now += 11
+    manager.save("fresh", {"openai_apiKey": "k"})
+    assert list(manager.store._rows) == ["fresh"]
+
+
+def test_cache_is_bounded():
+    manager = SessionManager(cache_size=2)
+    for sid in "abc":
+        manager.save(sid, {"n": sid})
+    assert list(manager._cache) == ["b", "c"]
+    assert manager.get("a")[0] == {"n": "a"}
+
+
+def test_lazy_session_copies_on_write():
+    manager = SessionManager()
+    manager.save("s", {"openai_apiKey": "k"})
+    session = LazySession(manager, "s")
+    assert not session.loaded
+    assert session["openai_apiKey"] == "k"
+    session["openai_model"] = "gpt-4o"
+    assert session.modified
+    assert manager.get("s")[0] == {"openai_apiKey": "k"}
+
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    worker_a, worker_b = SessionManager(SQLiteStore(path)), SessionManager(SQLiteStore(path))
+    worker_a.save("s", {"openai_apiKey": "first"})
+    assert worker_b.get("s")[0] == {"openai_apiKey": "first"}
+    worker_a.save("s", {"openai_apiKey": "second"})
+    # worker_b's cached copy is dropped as soon as the other worker commits
+    assert worker_b.get("s")[0] == {"openai_apiKey": "second"}
+    worker_a.close()
+    worker_b.close()
+
+
+def test_other_workers_writes_are_checked_for_at_most_once_per_interval(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "sessions.sqlite")
+    worker_a = SessionManager(SQLiteStore(path), clock=clock)
+    worker_b = SessionManager(SQLiteStore(path), clock=clock, sync_interval=1.0)
+    worker_a.save("s", {"openai_apiKey": "first"})
+    assert worker_b.get("s")[0] == {"openai_apiKey": "first"}
+    worker_a.save("s", {"openai_apiKey": "second"})
+    assert worker_b.get("s")[0] == {"openai_apiKey": "first"}
+    clock.now += 1
+    assert worker_b.get("s")[0] == {"openai_apiKey": "second"}
+    worker_a.close()
+    worker_b.close()
+
+
+def test_sessions_default_to_a_sqlite_file(monkeypatch, tmp_path):
+    monkeypatch.delenv("SESSION_STORE_PATH")
+    monkeypatch.setattr("sessions.DEFAULT_STORE_PATH", str(tmp_path / "sessions.sqlite"))
+    before_restart = SessionManager.from_env()
+    before_restart.save("s", {"openai_apiKey": "k"})
+    before_restart.close()
+    after_restart = SessionManager.from_env()
+    assert isinstance(after_restart.store, SQLiteStore)
+    assert after_restart.get("s")[0] == {"openai_apiKey": "k"}
+    after_restart.close()
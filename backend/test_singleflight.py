@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app import app
+from resilience import ResilienceConfig
+from singleflight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class Calls(list):
+    status = 200
+
+
+@pytest.fixture
+def upstream(mock_app):
+    calls = Calls()
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        if calls.status != 200:
+            return httpx.Response(calls.status, text="overloaded")
+        return httpx.Response(200, json={"choices": [{"message": {"content": "shared"}}]})
+
+    # No retries, so the shared error reaches every waiter after one upstream call
+    mock_app(handler, resilience=ResilienceConfig(max_retries=0))
+    return calls
+
+
+def proxy_client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy")
+
+
+BODY = {"apiKey": "k", "messages": [{"role": "user", "content": "same prompt"}]}
+
+
+async def test_concurrent_duplicates_make_one_upstream_call(upstream):
+    async with proxy_client() as c:
+        responses = await asyncio.gather(*(c.post("/api/llm/openai", json=BODY) for _ in range(20)))
+    assert len(upstream) == 1
+    assert all(r.status_code == 200 and r.json() == responses[0].json() for r in responses)
+    assert app.state.inflight.leaders == 1
+    assert app.state.inflight.followers == 19
+    assert len(app.state.inflight) == 0
+
+
+async def test_different_payloads_or_keys_are_not_coalesced(upstream):
+    async with proxy_client() as c:
+        await asyncio.gather(
+            c.post("/api/llm/openai", json=BODY),
+            c.post("/api/llm/openai", json={**BODY, "apiKey": "other"}),
+            c.post("/api/llm/openai", json={**BODY, "messages": []}),
+        )
+    assert len(upstream) == 3
+
+
+async def test_all_waiters_get_the_same_error(upstream):
+    upstream.status = 503
+    async with proxy_client() as c:
+        responses = await asyncio.gather(*(c.post("/api/llm/openai", json=BODY) for _ in range(5)))
+    assert len(upstream) == 1
+    assert [r.status_code for r in responses] == [503] * 5
+    assert all(r.json() == {"error": "overloaded"} for r in responses)
+
+
+async def test_cancelled_waiter_does_not_cancel_others():
+    flight = SingleFlight()
+    started = []
+
+    async def work():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    first = asyncio.ensure_future(flight.do("k", work))
+    second = asyncio.ensure_future(flight.do("k", work))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == "done"
+    assert first.cancelled()
+    assert len(started) == 1
+
+
+async def test_last_waiter_leaving_cancels_the_upstream_call():
+    flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    waiters = [asyncio.ensure_future(flight.do("k", work)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert len(flight) == 0
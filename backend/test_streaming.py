@@ -0,0 +1,147 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from resilience import ResilienceConfig
+from streaming import RelayResponse, relay
+
+OPENAI_SSE = [
+    b'data: {"model": "gpt-4o", "choices": [{"delta": {"role": "assistant"}}]}\n\n',
+    b'data: {"model": "gpt-4o", "choices": [{"delta": {"content": "Hel"}}]}\n\n',
+    b'data: {"model": "gpt-4o", "choices": [{"delta": {"content": "lo"}}]}\n\n',
+    b'data: {"model": "gpt-4o", "choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 2}}\n\n',
+    b"data: [DONE]\n\n",
+]
+
+ANTHROPIC_SSE = [
+    b'event: message_start\ndata: {"type": "message_start", "message": {"model": "claude-3", "usage": {"input_tokens": 7}}}\n\n',
+    b'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Hi "}}\n\n',
+    b'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "there"}}\n\n',
+    b'event: message_delta\ndata: {"type": "message_delta", "usage": {"output_tokens": 3}}\n\n',
+    b'event: message_stop\ndata: {"type": "message_stop"}\n\n',
+]
+
+
+class TrackingStream(httpx.AsyncByteStream):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def aclose(self):
+        self.closed = True
+
+
+def parse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture
+def upstream(mock_app):
+    calls = []
+
+    def handler(request):
+        calls.append(json.loads(request.content))
+        body = ANTHROPIC_SSE if "anthropic" in request.url.host else OPENAI_SSE
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=TrackingStream(body))
+
+    mock_app(handler)
+    return calls
+
+
+def test_openai_stream_normalized(upstream):
+    with TestClient(app) as c:
+        response = c.post("/api/llm/openai", json={"apiKey": "k", "stream": True, "messages": []})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(response.text)
+    assert [e for e in events if e[0] == "delta"] == [("delta", {"content": "Hel"}), ("delta", {"content": "lo"})]
+    assert events[-2] == ("usage", {"model": "gpt-4o", "promptTokens": 5, "completionTokens": 2, "totalTokens": 7})
+    assert events[-1] == ("done", {})
+    assert upstream[0]["stream"] is True
+    assert upstream[0]["stream_options"] == {"include_usage": True}
+
+
+def test_anthropic_stream_normalized(upstream):
+    with TestClient(app) as c:
+        response = c.post("/api/llm/anthropic", json={"apiKey": "k", "stream": True, "messages": []})
+    events = parse_events(response.text)
+    assert "".join(e[1]["content"] for e in events if e[0] == "delta") == "Hi there"
+    assert events[-2] == ("usage", {"model": "claude-3", "promptTokens": 7, "completionTokens": 3, "totalTokens": 10})
+    assert "stream_options" not in upstream[0]
+
+
+def test_databricks_stream_normalized(upstream):
+    with TestClient(app) as c:
+        response = c.post("/api/llm/databricks", json={
+            "apiKey": "k", "apiUrl": "https://fake-databricks.com/invocations", "stream": True, "messages": []})
+    events = parse_events(response.text)
+    assert "".join(e[1]["content"] for e in events if e[0] == "delta") == "Hello"
+    assert events[-1] == ("done", {})
+
+
+def test_stream_upstream_error_is_json(mock_app):
+    mock_app(lambda request: httpx.Response(429, text="rate limited"), resilience=ResilienceConfig(max_retries=0))
+    with TestClient(app) as c:
+        response = c.post("/api/llm/openai", json={"apiKey": "k", "stream": True, "messages": []})
+    assert response.status_code == 429
+    assert response.json() == {"error": "rate limited"}
+
+
+def test_streams_hold_a_concurrency_slot_until_done(mock_app):
+    in_flight = []
+
+    class Probe(TrackingStream):
+        async def __aiter__(self):
+            for chunk in self.chunks:
+                in_flight.append(sum(g.concurrency.in_flight for g in resilience._guards.values()))
+                yield chunk
+
+    resilience = mock_app(lambda request: httpx.Response(
+        200, headers={"content-type": "text/event-stream"}, stream=Probe(OPENAI_SSE))).resilience
+    with TestClient(app) as c:
+        c.post("/api/llm/openai", json={"apiKey": "k", "stream": True, "messages": []})
+    assert in_flight == [1] * len(OPENAI_SSE)
+    assert all(g.concurrency.in_flight == 0 for g in resilience._guards.values())
+
+
+@pytest.mark.anyio
+async def test_relay_closes_upstream_when_client_goes_away():
+    stream = TrackingStream(OPENAI_SSE)
+    resp = httpx.Response(200, stream=stream)
+    events = relay("openai", resp, "gpt-4o")
+    first = await events.__anext__()
+    assert first.startswith(b"event: delta")
+    await events.aclose()
+    assert stream.closed
+
+
+@pytest.mark.anyio
+async def test_relay_response_closes_relay_on_disconnect():
+    stream = TrackingStream(OPENAI_SSE)
+    response = RelayResponse(relay("openai", httpx.Response(200, stream=stream), "gpt-4o"))
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+        if message["type"] == "http.response.body":
+            raise OSError("client went away")
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(Exception):
+        await response(scope, receive, send)
+    assert len(sent) == 2
+    assert stream.closed
@@ -0,0 +1,87 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+
+from app import app
+from upstream import UpstreamClients, UpstreamConfig
+
+
+class StandIn:
+    """Tiny chat-completions stand-in that records the client port of every request."""
+
+    def __init__(self):
+        self.peers = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        while (await receive()).get("more_body"):
+            pass
+        self.peers.append(scope["client"][1])
+        body = json.dumps({"choices": [{"message": {"content": "stand-in"}}]}).encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+@pytest.fixture
+def stand_in():
+    handler = StandIn()
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(handler, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    handler.url = f"http://127.0.0.1:{port}/serving-endpoints/chat"
+    yield handler
+    server.should_exit = True
+    thread.join(5)
+
+
+def test_upstream_connection_reuse(stand_in, monkeypatch):
+    monkeypatch.setenv("DATABRICKS_API_KEY", "stand-in-key")
+    monkeypatch.setenv("DATABRICKS_API_URL", stand_in.url)
+    with TestClient(app) as c:
+        for _ in range(5):
+            response = c.post("/api/llm/databricks", json={"messages": [{"role": "user", "content": "hi"}]})
+            assert response.status_code == 200
+            assert "stand-in" in response.text
+    assert len(stand_in.peers) == 5
+    # Every call went over the same pooled keep-alive connection
+    assert len(set(stand_in.peers)) == 1
+
+
+def test_upstream_clients_closed_with_lifespan():
+    with TestClient(app) as c:
+        client = c.app.state.upstream.get("openai")
+        assert not client.is_closed
+    assert client.is_closed
+
+
+def test_upstream_config_from_env(monkeypatch):
+    monkeypatch.setenv("LLM_HTTP_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("ANTHROPIC_HTTP_MAX_CONNECTIONS", "3")
+    monkeypatch.setenv("ANTHROPIC_HTTP_READ_TIMEOUT", "120")
+    monkeypatch.setenv("OPENAI_HTTP_HTTP2", "false")
+    assert UpstreamConfig.from_env("openai").max_connections == 7
+    assert UpstreamConfig.from_env("openai").http2 is False
+    anthropic = UpstreamConfig.from_env("anthropic")
+    assert anthropic.max_connections == 3
+    assert anthropic.read_timeout == 120.0
+
+
+@pytest.mark.anyio
+async def test_upstream_clients_are_shared_per_provider():
+    clients = UpstreamClients(configs={"openai": UpstreamConfig(), "anthropic": UpstreamConfig()})
+    await clients.start()
+    assert clients.get("openai") is clients.get("openai")
+    assert clients.get("openai") is not clients.get("anthropic")
+    await clients.aclose()
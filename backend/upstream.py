@@ -0,0 +1,98 @@
+import importlib.util
+import os
+from dataclasses import dataclass
+
+import httpx
+
+PROVIDERS = ("openai", "anthropic", "databricks")
+
+
+def _setting(provider, name, default, cast=str):
+    # Per-provider override (OPENAI_HTTP_MAX_CONNECTIONS) wins over the shared
+    # default (LLM_HTTP_MAX_CONNECTIONS), which wins over the built-in value.
+    for key in (f"{provider.upper()}_HTTP_{name}", f"LLM_HTTP_{name}"):
+        value = os.environ.get(key)
+        if value not in (None, ""):
+            return cast(value)
+    return default
+
+
+def _bool(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def http2_available():
+    return importlib.util.find_spec("h2") is not None
+
+
+@dataclass
+class UpstreamConfig:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = True
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+    write_timeout: float = 60.0
+    pool_timeout: float = 10.0
+
+    @classmethod
+    def from_env(cls, provider):
+        return cls(
+            max_connections=_setting(provider, "MAX_CONNECTIONS", cls.max_connections, int),
+            max_keepalive_connections=_setting(provider, "MAX_KEEPALIVE", cls.max_keepalive_connections, int),
+            keepalive_expiry=_setting(provider, "KEEPALIVE_EXPIRY", cls.keepalive_expiry, float),
+            http2=_setting(provider, "HTTP2", cls.http2, _bool),
+            connect_timeout=_setting(provider, "CONNECT_TIMEOUT", cls.connect_timeout, float),
+            read_timeout=_setting(provider, "READ_TIMEOUT", cls.read_timeout, float),
+            write_timeout=_setting(provider, "WRITE_TIMEOUT", cls.write_timeout, float),
+            pool_timeout=_setting(provider, "POOL_TIMEOUT", cls.pool_timeout, float),
+        )
+
+    def client_kwargs(self):
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "timeout": httpx.Timeout(
+                connect=self.connect_timeout,
+                read=self.read_timeout,
+                write=self.write_timeout,
+                pool=self.pool_timeout,
+            ),
+            # HTTP/2 needs the optional `h2` package; fall back to HTTP/1.1
+            # keep-alive when it is not installed.
+            "http2": self.http2 and http2_available(),
+        }
+
+
+class UpstreamClients:
+    """One long-lived httpx.AsyncClient per provider, owned by the app lifespan."""
+
+    def __init__(self, configs=None, transport=None):
+        self.configs = configs or {p: UpstreamConfig.from_env(p) for p in PROVIDERS}
+        self.transport = transport
+        self._clients = {}
+
+    def _create(self, provider):
+        kwargs = self.configs.get(provider, UpstreamConfig()).client_kwargs()
+        if self.transport is not None:
+            kwargs["transport"] = self.transport
+        return httpx.AsyncClient(**kwargs)
+
+    async def start(self):
+        for provider in self.configs:
+            self.get(provider)
+
+    def get(self, provider):
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            client = self._clients[provider] = self._create(provider)
+        return client
+
+    async def aclose(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
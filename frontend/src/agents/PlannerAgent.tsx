@@ -63,6 +63,7 @@ export function PlannerAgent(props: { sx?: object }) {
         messages: messages,
         model: llms[provider].model || '',
         apiUrl: llms[provider].apiUrl || '',
+        agent: 'PlannerAgent',
       });
 
       const plan = response.content;
@@ -55,6 +55,7 @@ export function ResearchAgent(props: { sx?: object }) {
           messages: messages,
           model: llms[provider].model || '',
           apiUrl: llms[provider].apiUrl || '',
+          agent: 'ResearchAgent',
         });
         setResearch(researchResults.content);
         
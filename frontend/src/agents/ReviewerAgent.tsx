@@ -44,6 +44,7 @@ export function ReviewerAgent(props: { sx?: object }) {
           messages: messages,
           model: llms[provider].model || '',
           apiUrl: llms[provider].apiUrl || '',
+          agent: 'ReviewerAgent',
         });
         // Emit LLM response event
         emit("llm_request", {
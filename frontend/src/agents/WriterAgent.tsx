@@ -60,6 +60,7 @@ export function WriterAgent(props: { sx?: object }) {
           messages: messages,
           model: llms[provider].model || '',
           apiUrl: llms[provider].apiUrl || '',
+          agent: 'WriterAgent',
         });
         const usageRaw = generatedContent.usage as any;
         const usage = usageRaw
@@ -144,6 +145,7 @@ export function WriterAgent(props: { sx?: object }) {
           messages: messages,
           model: llms[provider].model || '',
           apiUrl: llms[provider].apiUrl || '',
+          agent: 'WriterAgent',
         });
         const usageRaw2 = revisedContent.usage as any;
         const usage2 = usageRaw2
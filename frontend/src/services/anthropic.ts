@@ -16,6 +16,7 @@ export async function callLLM(params: LLMParams): Promise<LLMResponse> {
         stream: false,
         apiUrl: params.apiUrl,
         provider: params.provider,
+        agent: params.agent,
       })
     });
 
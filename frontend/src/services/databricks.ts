@@ -1,6 +1,6 @@
 import type { CallLLMParams } from './openai';
 
-export async function callLLM({ messages, model, apiKey, apiUrl }: CallLLMParams): Promise<string> {
+export async function callLLM({ messages, model, apiKey, apiUrl, agent }: CallLLMParams): Promise<string> {
   if (!apiKey || !apiUrl) throw new Error('Databricks API key and URL are required');
   const res = await fetch('/api/llm/databricks', {
     method: 'POST',
@@ -12,6 +12,7 @@ export async function callLLM({ messages, model, apiKey, apiUrl }: CallLLMParams
       model,
       apiKey,
       apiUrl,
+      agent,
     }),
   });
   if (!res.ok) throw new Error('Databricks API error: ' + res.statusText);
@@ -17,6 +17,8 @@ export interface LLMParams {
   temperature?: number;
   apiUrl?: string;
   apiKey?: string;
+  // Recorded in the backend call journal, so its calls can be filtered by agent
+  agent?: string;
 }
 
 export interface LLMResponse {
@@ -62,4 +64,185 @@ export async function callLLM(params: LLMParams): Promise<LLMResponse> {
     default:
       throw new Error('Unknown provider');
   }
-} 
\ No newline at end of file
+} 
+// Stream a completion through the backend proxy (`stream: true`). The backend
+// relays provider deltas as normalized SSE events (delta / usage / error / done)
+// so the same parser works for every provider. `onDelta` fires per chunk; the
+// resolved value is the full reply, shaped like callLLM's.
+export async function streamLLM(
+  params: LLMParams,
+  onDelta: (chunk: string) => void,
+  signal?: AbortSignal
+): Promise<LLMResponse> {
+  const response = await fetch(`/api/llm/${params.provider}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json'
+    },
+    credentials: 'include',
+    signal,
+    body: JSON.stringify({
+      model: params.model,
+      messages: params.messages,
+      max_tokens: params.maxTokens || 1000,
+      temperature: params.temperature ?? 0.7,
+      stream: true,
+      apiUrl: params.apiUrl,
+      apiKey: params.apiKey,
+      provider: params.provider,
+      agent: params.agent,
+    })
+  });
+  if (!response.ok || !response.body) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(`${params.provider} API error: ${response.status} ${response.statusText} - ${JSON.stringify(errorData)}`);
+  }
+
+  const result: LLMResponse = {
+    content: '',
+    model: params.model,
+    usage: { promptTokens: 0, completionTokens: 0, totalTokens: 0 }
+  };
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = block.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(block.match(/^data: (.*)$/m)?.[1] || '{}');
+      if (event === 'delta') {
+        result.content += data.content;
+        onDelta(data.content);
+      } else if (event === 'usage') {
+        result.model = data.model || result.model;
+        result.usage = {
+          promptTokens: data.promptTokens,
+          completionTokens: data.completionTokens,
+          totalTokens: data.totalTokens
+        };
+      } else if (event === 'error') {
+        throw new Error(`${params.provider} stream error: ${data.error}`);
+      }
+    }
+  }
+  return result;
+}
+
+export interface BatchResult {
+  index: number;
+  provider: LLMProvider;
+  status: number;
+  body: any;
+  // Present when the request asked for `compact`
+  compaction?: {
+    promptTokensBefore: number;
+    promptTokensAfter: number;
+    tokensSaved: number;
+    dedupedBlocks: number;
+    droppedMessages: number;
+    truncatedMessages: number;
+  };
+}
+
+// Run several LLM calls in one round-trip through `/api/llm/batch`. The backend
+// runs them concurrently (capped per provider) and streams each result back as
+// an NDJSON line as soon as it completes; `onResult` fires in completion order.
+export async function callLLMBatch(
+  requests: LLMParams[],
+  onResult: (result: BatchResult) => void,
+  timeoutSeconds?: number
+): Promise<BatchResult[]> {
+  const response = await fetch('/api/llm/batch', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json'
+    },
+    credentials: 'include',
+    body: JSON.stringify({
+      timeout: timeoutSeconds,
+      requests: requests.map(params => ({
+        provider: params.provider,
+        model: params.model,
+        messages: params.messages,
+        max_tokens: params.maxTokens || 1000,
+        temperature: params.temperature ?? 0.7,
+        apiUrl: params.apiUrl,
+        apiKey: params.apiKey,
+      }))
+    })
+  });
+  if (!response.ok || !response.body) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(`Batch API error: ${response.status} ${response.statusText} - ${JSON.stringify(errorData)}`);
+  }
+
+  const results: BatchResult[] = [];
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let newline;
+    while ((newline = buffer.indexOf('\n')) !== -1) {
+      const line = buffer.slice(0, newline);
+      buffer = buffer.slice(newline + 1);
+      if (!line) continue;
+      const result: BatchResult = JSON.parse(line);
+      results[result.index] = result;
+      onResult(result);
+    }
+  }
+  return results;
+}
+
+export interface LLMCall {
+  id: number;
+  ts: number;
+  session: string | null;
+  flowId: string | null;
+  agent: string | null;
+  provider: LLMProvider;
+  model: string;
+  stream: boolean;
+  status: number;
+  cache: 'HIT' | 'MISS' | 'BYPASS' | null;
+  latencyMs: number;
+  usage: LLMResponse['usage'] | null;
+  error: string | null;
+  request: { messages?: Message[]; temperature?: number; max_tokens?: number };
+  response: string | null;
+}
+
+export interface LLMCallQuery {
+  limit?: number;
+  before?: number;
+  agent?: string;
+  provider?: LLMProvider;
+  flowId?: string;
+  since?: number;
+  until?: number;
+}
+
+// One page of this session's journaled calls from `/api/llm/calls`, newest
+// first. Pass the returned `nextCursor` as `before` to fetch the next page;
+// it is null on the last one. The backend journal is on when LLM_JOURNAL_DIR is set.
+export async function fetchLLMCalls(query: LLMCallQuery = {}): Promise<{ calls: LLMCall[]; nextCursor: number | null }> {
+  const params = new URLSearchParams();
+  Object.entries(query).forEach(([key, value]) => {
+    if (value !== undefined) params.set(key, String(value));
+  });
+  const response = await fetch(`/api/llm/calls?${params}`, { credentials: 'include' });
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(`Call journal error: ${response.status} ${response.statusText} - ${JSON.stringify(errorData)}`);
+  }
+  return response.json();
+}
@@ -13,16 +13,18 @@ export interface CallLLMParams {
   model: string;
   apiKey?: string;
   apiUrl?: string; // for databricks
+  agent?: string;
 }
 
 let openaiClient: OpenAI | null = null;
 
-export async function callLLM({ provider, messages, model, apiKey, apiUrl }: CallLLMParams): Promise<{ content: string; model: string; usage: { promptTokens: number; completionTokens: number; totalTokens: number } }> {
+export async function callLLM({ provider, messages, model, apiKey, apiUrl, agent }: CallLLMParams): Promise<{ content: string; model: string; usage: { promptTokens: number; completionTokens: number; totalTokens: number } }> {
   if (provider === 'openai') {
     const body: any = {
       messages,
       model,
       provider,
+      agent,
       apiUrl: apiUrl || 'https://api.openai.com/v1/chat/completions',
     };
     const response = await fetch('/api/llm/openai', {